@@ -0,0 +1,146 @@
+# simulated annealing optimizer, an alternative to optimize_teams with a predictable runtime
+#
+# optimize_teams only ever accepts swaps that improve the balance, so once no single swap helps it is stuck
+# (a local optimum), and how long it takes depends on how many rounds it needs. annealing instead:
+#   - picks a random neighbour of the current assignment: either a swap of 2 students between 2 teams,
+#     or a move of 1 student to another team (only where team sizes allow it, see can_move)
+#   - always accepts a neighbour that is better, and accepts a worse one with probability exp(-change / temp)
+#   - lowers temp from start_temp to end_temp as the budget gets used up, so it explores first and settles later
+#   - remembers the best assignment seen, and returns that one when the budget runs out
+#   - stops early when the best assignment is within BOUND_TOLERANCE per team of the lower bound
+# the budget is a wall clock time (seconds) and/or a number of evaluated neighbours, whichever runs out first.
+# an evaluation budget is deterministic for a given rng seed, a time budget is not.
+
+import math
+import random
+import time
+
+import multipletutgrp
+from multipletutgrp import (SWAP_EPSILON, apply_swap, emit, imbalance_after_swap, init_team_state, refresh_team_fields, report_bound,
+                            stop_imbalance)
+
+def max_freq_after_move(freq, key_out, key_in):
+    # like max_freq_after_swap, but key_out / key_in can be None when the team only loses or only gains a student
+    counts = dict(freq)
+    if key_out is not None:
+        counts[key_out] -= 1
+    if key_in is not None:
+        counts[key_in] = counts.get(key_in, 0) + 1
+    return max(counts.values())
+
+def imbalance_after_move(state, student_out, student_in, tut_avg_cgpa):
+    # imbalance of a team that loses student_out (or None) and gains student_in (or None)
+    size = state['size']
+    cgpa_sum = state['cgpa_sum']
+    if student_out is not None:
+        size -= 1
+        cgpa_sum -= student_out.cgpa
+    if student_in is not None:
+        size += 1
+        cgpa_sum += student_in.cgpa
+
+    half_size = size // 2
+    school_out = student_out.school if student_out is not None else None
+    school_in = student_in.school if student_in is not None else None
+    gender_out = student_out.gender if student_out is not None else None
+    gender_in = student_in.gender if student_in is not None else None
+    cgpa_imbalance = abs(cgpa_sum / size - tut_avg_cgpa)
+    school_imbalance = max_freq_after_move(state['school_freq'], school_out, school_in) - half_size
+    gender_imbalance = max_freq_after_move(state['gender_freq'], gender_out, gender_in) - half_size
+    return cgpa_imbalance + max(school_imbalance, 0) + max(gender_imbalance, 0)
+
+def apply_move(state, student, joining, new_imbalance):
+    # joining=True adds student to the team of state, joining=False takes them out
+    sign = 1 if joining else -1
+    state['size'] += sign
+    state['cgpa_sum'] += sign * student.cgpa
+    for freq, key in ((state['school_freq'], student.school), (state['gender_freq'], student.gender)):
+        freq[key] = freq.get(key, 0) + sign
+        if freq[key] == 0:
+            del freq[key]
+    state['imbalance'] = new_imbalance
+
+def can_move(teams, i, j, min_size, max_size):
+    # a move must keep every team between the smallest and biggest team size that form_teams made
+    return len(teams[i]) - 1 >= min_size and len(teams[j]) + 1 <= max_size
+
+def anneal_teams(teams, tut_avg_cgpa, time_budget=None, max_evaluations=20000, rng=random,
+                 start_temp=1.0, end_temp=0.001, move_chance=0.2):
+    if len(teams) < 2:
+        return teams # nothing to swap or move between
+
+    states = [init_team_state(team, tut_avg_cgpa) for team in teams]
+    min_size = min(len(team) for team in teams)
+    max_size = max(len(team) for team in teams)
+    moves_possible = min_size != max_size # all teams the same size -> a move would always break the sizes
+
+    current_imbalance = sum(state['imbalance'] for state in states)
+    lower_bound, stop_at = stop_imbalance(teams, tut_avg_cgpa)
+    best_imbalance = current_imbalance
+    best_teams = [team[:] for team in teams]
+
+    start_time = time.perf_counter()
+    evaluations = 0
+    accepted = 0
+    progress = 0.0
+
+    while progress < 1.0 and best_imbalance > stop_at: # also stop once the best is (nearly) at the lower bound
+        # how much of the budget is used, from 0 to 1, the temperature follows from it
+        if max_evaluations is not None:
+            progress = evaluations / max_evaluations
+        if time_budget is not None and evaluations % 256 == 0: # reading the clock every step would cost too much
+            progress = max(progress, (time.perf_counter() - start_time) / time_budget)
+        if progress >= 1.0:
+            break
+        temp = start_temp * (end_temp / start_temp) ** progress
+        evaluations += 1
+
+        i, j = rng.sample(range(len(teams)), 2)
+        team1, team2 = teams[i], teams[j]
+        state1, state2 = states[i], states[j]
+
+        if moves_possible and rng.random() < move_chance and can_move(teams, i, j, min_size, max_size):
+            # move a random student of team1 over to team2
+            a = rng.randrange(len(team1))
+            student = team1[a]
+            new_team1_imbalance = imbalance_after_move(state1, student, None, tut_avg_cgpa)
+            new_team2_imbalance = imbalance_after_move(state2, None, student, tut_avg_cgpa)
+            change = new_team1_imbalance + new_team2_imbalance - state1['imbalance'] - state2['imbalance']
+            if change < -SWAP_EPSILON or rng.random() < math.exp(-change / temp):
+                team2.append(team1.pop(a))
+                apply_move(state1, student, False, new_team1_imbalance)
+                apply_move(state2, student, True, new_team2_imbalance)
+                current_imbalance += change
+                accepted += 1
+            else:
+                continue
+        else:
+            # swap a random student of team1 with a random student of team2
+            a = rng.randrange(len(team1))
+            b = rng.randrange(len(team2))
+            student1, student2 = team1[a], team2[b]
+            new_team1_imbalance = imbalance_after_swap(state1, student1, student2, tut_avg_cgpa)
+            new_team2_imbalance = imbalance_after_swap(state2, student2, student1, tut_avg_cgpa)
+            change = new_team1_imbalance + new_team2_imbalance - state1['imbalance'] - state2['imbalance']
+            if change < -SWAP_EPSILON or rng.random() < math.exp(-change / temp):
+                team1[a], team2[b] = student2, student1
+                apply_swap(state1, student1, student2, new_team1_imbalance)
+                apply_swap(state2, student2, student1, new_team2_imbalance)
+                current_imbalance += change
+                accepted += 1
+            else:
+                continue
+
+        if current_imbalance < best_imbalance - SWAP_EPSILON:
+            best_imbalance = current_imbalance
+            best_teams = [team[:] for team in teams]
+
+    if multipletutgrp.hooks: # annealing has no rounds, the whole run is reported as 1 round
+        emit('round', {'tut_group': teams[0][0].tutorial_group, 'round': 1, 'evaluated': evaluations, 'accepted': accepted})
+
+    # hand back the best assignment seen, not wherever the random walk ended up
+    for team, best_team in zip(teams, best_teams):
+        team[:] = best_team
+    refresh_team_fields(teams)
+    report_bound(teams, tut_avg_cgpa, lower_bound)
+    return teams
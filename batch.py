@@ -0,0 +1,186 @@
+# asyncio batch runner for many cohort files at once
+#
+# every cohort file is a job: read -> solve every tut grp -> write, like multipletutgrp.py, but all jobs share 1
+# process pool and run side by side:
+#   - reading and writing the files runs in threads (asyncio.to_thread), so the event loop keeps scheduling while
+#     a big file is being read
+#   - every tut grp is sent to the shared process pool on its own, with the same seeds as solve_tut_grps, so a job's
+#     output is identical to `python multipletutgrp.py --seed ... --input <file>`
+#   - backpressure: submit() waits while max_queued jobs are already waiting, at most max_jobs cohorts are loaded
+#     at a time, and at most workers * 2 tut grps are handed to the pool at a time, so a cohort with 1000 tut grps
+#     does not fill the pool's queue
+#   - fairness: a job has at most per_job tut grps waiting for the pool, and the pool slots are handed out first
+#     come first served, so small jobs get their turns in between the tut grps of a huge one
+#   - time_limit: a job that takes longer is stopped with status "timeout" and writes nothing; cancel(job) does the
+#     same with status "cancelled". tut grps that have not started are dropped from the pool, one that is already
+#     running in a worker finishes there and its result is thrown away
+# the output is written to a temporary file in a thread and renamed back on the event loop, only after checking
+# that the job was not stopped meanwhile (the thread itself cannot be stopped), so a stopped job never leaves an
+# output file behind, not even half a csv.
+#
+# usage: python batch.py cohort_a.csv cohort_b.csv --workers 8 --time-limit 120 --output-dir results
+#    or: async with BatchRunner(workers=8) as runner: job = await runner.submit("a.csv", "a_teams.csv")
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from multipletutgrp import (OPTIMIZERS, _replay_events, _solve_tut_grp_job, hooks, read_student_records, tut_grp_seed,
+                            write_student_records)
+
+class BatchJob:
+    # status goes queued -> running -> done / timeout / failed / cancelled
+    def __init__(self, input_filename, output_filename):
+        self.input_filename = input_filename
+        self.output_filename = output_filename
+        self.status = "queued"
+        self.error = None
+        self.tut_grps = 0
+        self.seconds = 0.0
+        self.task = None # the asyncio task while it is running
+
+    def __repr__(self):
+        return f"BatchJob({self.input_filename!r}, status={self.status!r})"
+
+def temporary_path(output_filename):
+    output_path = Path(__file__).parent / output_filename
+    return output_path, output_path.with_name(output_path.name + ".tmp")
+
+def discard(temp_path):
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+class BatchRunner:
+    def __init__(self, workers=1, max_jobs=4, max_queued=16, per_job=None, time_limit=None, seed=None, **options):
+        # options are passed on to solve_tut_grp for every tut grp (max_rounds, optimizer, ...)
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.max_queued = max_queued
+        self.per_job = per_job or workers
+        self.time_limit = time_limit
+        self.seed = seed
+        self.options = options
+        self.jobs = []
+
+    async def __aenter__(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.queue = asyncio.Queue(maxsize=self.max_queued)
+        self.pool_slots = asyncio.Semaphore(self.workers * 2)
+        self.consumers = [asyncio.create_task(self.consume()) for _ in range(self.max_jobs)]
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        try:
+            if exc_type is None:
+                await self.queue.join() # let every submitted job finish
+        finally:
+            for consumer in self.consumers:
+                consumer.cancel()
+            await asyncio.gather(*self.consumers, return_exceptions=True)
+            self.executor.shutdown(cancel_futures=True)
+
+    async def submit(self, input_filename, output_filename):
+        # waits while the queue is full, that is the backpressure on whoever is submitting
+        job = BatchJob(input_filename, output_filename)
+        self.jobs.append(job)
+        await self.queue.put(job)
+        return job
+
+    def cancel(self, job):
+        if job.task is not None:
+            job.task.cancel()
+        elif job.status == "queued":
+            job.status = "cancelled" # still in the queue, the consumer will skip it
+
+    async def consume(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.status == "queued":
+                    job.task = asyncio.create_task(self.run_job(job))
+                    await asyncio.wait([job.task]) # not `await job.task`, a cancelled job must not cancel the consumer
+            finally:
+                job.task = None
+                self.queue.task_done()
+
+    async def run_job(self, job):
+        job.status = "running"
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.solve_job(job), self.time_limit)
+            job.status = "done"
+        except asyncio.TimeoutError:
+            job.status = "timeout"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as error: # 1 broken cohort file must not stop the others
+            job.status = "failed"
+            job.error = f"{type(error).__name__}: {error}"
+        finally:
+            job.seconds = time.perf_counter() - start
+
+    async def solve_job(self, job):
+        all_students = await asyncio.to_thread(read_student_records, job.input_filename)
+        job.tut_grps = len(all_students)
+        loop = asyncio.get_running_loop()
+        job_slots = asyncio.Semaphore(self.per_job)
+
+        async def solve(tut_group, students):
+            async with job_slots:
+                async with self.pool_slots:
+                    work = (tut_group, students, tut_grp_seed(self.seed, tut_group), self.options, bool(hooks))
+                    result = await loop.run_in_executor(self.executor, _solve_tut_grp_job, work)
+            return _replay_events(result)
+
+        # gather keeps the tut grps in file order, so the teams are numbered exactly like a normal run
+        results = await asyncio.gather(*(solve(tut_group, students) for tut_group, students in all_students.items()))
+        output_path, temp_path = temporary_path(job.output_filename)
+        write = asyncio.ensure_future(asyncio.to_thread(write_student_records, dict(zip(all_students, results)), temp_path))
+        try:
+            await asyncio.shield(write) # a timeout / cancel stops the waiting, not the thread
+        except asyncio.CancelledError:
+            write.add_done_callback(lambda _: discard(temp_path)) # remove the temp file once the thread is done with it
+            raise
+        except Exception:
+            discard(temp_path)
+            raise
+        os.replace(temp_path, output_path) # on the loop with no await since the check above, so it cannot be stopped halfway
+
+async def run_files(input_filenames, output_dir=".", **runner_options):
+    output_path = Path(__file__).parent / output_dir
+    output_path.mkdir(parents=True, exist_ok=True)
+    async with BatchRunner(**runner_options) as runner:
+        for input_filename in input_filenames:
+            await runner.submit(input_filename, output_path / f"{Path(input_filename).stem}_balanced_teams.csv")
+    return runner.jobs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="+", help="cohort csv files (or snapshot.py snapshots), relative to this file")
+    parser.add_argument("--output-dir", default=".", help="directory for the <input>_balanced_teams.csv files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="size of the shared process pool")
+    parser.add_argument("--max-jobs", type=int, default=4, help="cohorts loaded and solved at the same time")
+    parser.add_argument("--per-job", type=int, default=None, help="tut grps of 1 cohort waiting for the pool at a time (default: --workers)")
+    parser.add_argument("--time-limit", type=float, default=None, help="seconds a cohort may take before it is stopped")
+    parser.add_argument("--seed", default=None, help="base seed, each tut grp derives its own seed from it")
+    parser.add_argument("--optimizer", choices=OPTIMIZERS, default="swap",
+                        help="swap = pairwise swaps, anneal = simulated annealing, neighbourhood = swaps between promising teams only")
+    parser.add_argument("--max-rounds", type=int, default=100, help="max_rounds for the swap optimization")
+    args = parser.parse_args()
+
+    jobs = asyncio.run(run_files(args.inputs, args.output_dir, workers=args.workers, max_jobs=args.max_jobs,
+                                 max_queued=len(args.inputs), per_job=args.per_job, time_limit=args.time_limit,
+                                 seed=args.seed, max_rounds=args.max_rounds, optimizer=args.optimizer))
+    for job in jobs:
+        print(f"{job.status:>9} {job.seconds:8.2f}s {job.tut_grps:>6} tut grps  {job.input_filename}"
+              + (f"  ({job.error})" if job.error else ""))
+    if any(job.status != "done" for job in jobs):
+        sys.exit(1)
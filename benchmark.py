@@ -0,0 +1,144 @@
+# scale benchmark for the team formation pipeline
+#
+# for every (rows, group size) combination a synthetic cohort is generated with generate_cohort.py and run through
+# the 4 phases of multipletutgrp.py: read -> form -> optimise -> write. for every phase we record
+#   - wall time (seconds)
+#   - peak memory (bytes allocated by python during the phase, from tracemalloc; off with --no-memory)
+# and after form and optimise the total imbalance and the mean imbalance per team.
+# the results are saved as json, and --baseline compares them with an older json so a slower or worse
+# version shows up (exit code 1 if anything got worse than --tolerance allows).
+#
+# note: tracemalloc itself slows python down, use --no-memory when only the times matter.
+#
+# usage: python benchmark.py --rows 6000 60000 --group-sizes 10 50 200 --output bench.json
+
+from pathlib import Path
+import argparse
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from generate_cohort import write_cohort
+from multipletutgrp import (calc_avg_cgpa, calculate_team_imbalance, form_teams, optimize_teams, read_student_records,
+                            tut_grp_seed, write_student_records)
+
+def run_phase(results, name, measure_memory, function, *args):
+    if measure_memory:
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    value = function(*args)
+    results[f"{name}_seconds"] = time.perf_counter() - start
+    if measure_memory:
+        results[f"{name}_peak_bytes"] = tracemalloc.get_traced_memory()[1] - start_memory
+    return value
+
+def total_imbalance(tut_grps, tut_avg_cgpas):
+    total = 0.0
+    num_of_teams = 0
+    for tut_grp, teams in tut_grps.items():
+        for team in teams:
+            total += calculate_team_imbalance(team, tut_avg_cgpas[tut_grp])
+            num_of_teams += 1
+    return total, num_of_teams
+
+def form_all(all_students, seed):
+    return {tut_grp: form_teams(students, random.Random(tut_grp_seed(seed, tut_grp))) for tut_grp, students in all_students.items()}
+
+def optimise_all(tut_grps, tut_avg_cgpas, max_rounds):
+    return {tut_grp: optimize_teams(teams, tut_avg_cgpas[tut_grp], max_rounds) for tut_grp, teams in tut_grps.items()}
+
+def run_case(rows, group_size, seed, max_rounds, measure_memory, work_dir):
+    results = {'rows': rows, 'group_size': group_size, 'seed': seed, 'max_rounds': max_rounds}
+    input_file = write_cohort(work_dir / f"cohort_{rows}_{group_size}.csv", rows, group_size, seed)
+    output_file = work_dir / "balanced_teams.csv"
+
+    if measure_memory:
+        tracemalloc.start()
+    try:
+        all_students = run_phase(results, "read", measure_memory, read_student_records, input_file)
+        tut_avg_cgpas = {tut_grp: calc_avg_cgpa(students) for tut_grp, students in all_students.items()}
+
+        formed = run_phase(results, "form", measure_memory, form_all, all_students, seed)
+        results['form_imbalance'], num_of_teams = total_imbalance(formed, tut_avg_cgpas)
+
+        optimised = run_phase(results, "optimise", measure_memory, optimise_all, formed, tut_avg_cgpas, max_rounds)
+        results['optimise_imbalance'], num_of_teams = total_imbalance(optimised, tut_avg_cgpas)
+
+        run_phase(results, "write", measure_memory, write_student_records, optimised, output_file)
+    finally:
+        if measure_memory:
+            tracemalloc.stop()
+
+    results['num_of_teams'] = num_of_teams
+    results['mean_team_imbalance'] = results['optimise_imbalance'] / num_of_teams
+    results['total_seconds'] = sum(results[f"{phase}_seconds"] for phase in ("read", "form", "optimise", "write"))
+    input_file.unlink()
+    output_file.unlink()
+    return results
+
+def compare(results, baseline, tolerance):
+    # returns a list of text lines for every case / metric that got worse than tolerance allows
+    old_cases = {(case['rows'], case['group_size']): case for case in baseline['results']}
+    regressions = []
+    for case in results:
+        old = old_cases.get((case['rows'], case['group_size']))
+        if old is None:
+            continue
+        for key, value in case.items():
+            # times and memory can be a bit noisy, so they get the tolerance; imbalance should simply not go up
+            if key.endswith("_seconds") or key.endswith("_bytes"):
+                limit = old.get(key, 0) * tolerance
+            elif key.endswith("_imbalance"):
+                limit = old.get(key, 0) + 1e-9
+            else:
+                continue
+            if key in old and value > limit:
+                regressions.append(f"rows={case['rows']} group_size={case['group_size']} {key}: {old[key]:.4g} -> {value:.4g}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[6000, 60000, 600000], help="cohort sizes to run")
+    parser.add_argument("--group-sizes", type=int, nargs="+", default=[10, 50, 200, 2000], help="tutorial group sizes to run")
+    parser.add_argument("--seed", default="bench", help="seed for the cohorts and the team formation")
+    parser.add_argument("--max-rounds", type=int, default=100, help="max_rounds for optimize_teams")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, gives cleaner times")
+    parser.add_argument("--output", default="benchmark_results.json", help="json file to save the results to")
+    parser.add_argument("--baseline", default=None, help="older results json to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="allowed slowdown / memory growth vs the baseline")
+    args = parser.parse_args()
+
+    all_results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for rows in args.rows:
+            for group_size in args.group_sizes:
+                if group_size > rows:
+                    continue
+                case = run_case(rows, group_size, args.seed, args.max_rounds, not args.no_memory, Path(work_dir))
+                all_results.append(case)
+                print(f"rows={rows:>7} group_size={group_size:>5} "
+                      + " ".join(f"{phase}={case[f'{phase}_seconds']:.2f}s" for phase in ("read", "form", "optimise", "write"))
+                      + f" imbalance/team={case['mean_team_imbalance']:.4f}")
+
+    output = {
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'results': all_results
+    }
+    with (Path(__file__).parent / args.output).open("w", encoding="utf-8") as file:
+        json.dump(output, file, indent=2)
+
+    if args.baseline is not None:
+        with (Path(__file__).parent / args.baseline).open("r", encoding="utf-8") as file:
+            regressions = compare(all_results, json.load(file), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,382 @@
+# declarative balancing criteria
+#
+# the balancing rules are data, a list of criteria:
+#   {"type": "mean", "attribute": "cgpa", "tolerance": 0.5, "weight": 1}
+#       the team mean of a numeric attribute should be close to the tut grp mean: costs weight * |difference|,
+#       and with a tolerance a student who would push the team further away than that cannot join it
+#   {"type": "majority", "attribute": "school", "cap": 0.5, "weight": 1}
+#       no value of a categorical attribute should have more than cap of the team (rounded down): costs
+#       weight * how many over, and a student who would go over cannot join
+# the built in rules are multipletutgrp.DEFAULT_CRITERIA (cgpa within CGPA_TOLERANCE, no school / gender over
+# half the team). attributes are the Student fields, or any extra csv column (see Student.extra), so a new rule
+# needs a new line in a json file instead of new loops.
+# criteria can come from a service request, so they are checked before any code is generated for them:
+# parse_criteria checks the spec itself (known keys, numbers where numbers go), check_criteria also checks the
+# attributes against the students (a Student field or an extra column, and a mean needs numbers).
+#
+# compile_criteria turns a list of criteria into an Evaluator: python source with 1 flat line per criterion, over
+# running per team aggregates, is generated once and exec'd. the state of a team is a dict with its 'size',
+# '<attribute>_sum' for every mean criterion, '<attribute>_freq' (value -> count) for every majority criterion and
+# its 'imbalance'. the generated functions take the tut grp means of the mean criteria as extra arguments, in
+# order (group_means returns them as a tuple), so for the built in rules that is just tut_avg_cgpa:
+#   init_state, team_imbalance        the state / imbalance of a team, from scratch
+#   imbalance_after_swap, apply_swap  the swap optimization
+#   can_add                           whether 1 student may join a team
+#   candidate_key, eligible_ranges    the same question answered for all candidates at once, for form_teams: the
+#                                     candidates are bucketed by the values of their majority attributes and every
+#                                     bucket is sorted on the first mean attribute with a tolerance, so a team's
+#                                     allowed buckets follow from its counts and the allowed students of a bucket
+#                                     are 1 slice found with bisect
+# multipletutgrp's can_add_student, calculate_team_imbalance, imbalance_after_swap etc. are the compiled
+# DEFAULT_CRITERIA, print(multipletutgrp.RULES.source) shows the code.
+#
+# usage: python multipletutgrp.py --criteria criteria.json
+#    or: solve_tut_grp(students, seed, criteria=[{...}, ...])
+
+from bisect import bisect_left, bisect_right
+from fractions import Fraction
+import json
+import math
+
+STUDENT_FIELDS = ('tutorial_group', 'student_id', 'school', 'name', 'gender', 'cgpa')
+
+class NumericMean:
+    def __init__(self, attribute, tolerance=None, weight=1.0):
+        self.attribute = attribute
+        self.tolerance = tolerance # None: only counts towards the imbalance, never stops a student from joining
+        self.weight = weight
+
+    def spec(self):
+        return {'type': "mean", 'attribute': self.attribute, 'tolerance': self.tolerance, 'weight': self.weight}
+
+class CategoricalMajority:
+    def __init__(self, attribute, cap=0.5, weight=1.0):
+        self.attribute = attribute
+        self.cap = cap # share of the team 1 value may have, 0.5 -> team size // 2
+        self.weight = weight
+
+    def spec(self):
+        return {'type': "majority", 'attribute': self.attribute, 'cap': self.cap, 'weight': self.weight}
+
+SPEC_KEYS = {"mean": ('type', 'attribute', 'tolerance', 'weight'), "majority": ('type', 'attribute', 'cap', 'weight')}
+
+def number(spec, name, value, low=0.0, high=None, low_allowed=True):
+    # value as a float, ValueError unless it is a finite number (not a bool, not a string) in the range
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{name} of criterion {spec} must be a number, not {value!r}")
+    value = float(value)
+    if value < low or (value == low and not low_allowed) or (high is not None and value > high):
+        raise ValueError(f"{name} of criterion {spec} must be {'at least' if low_allowed else 'above'} {low:g}"
+                         + (f" and at most {high:g}" if high is not None else "") + f", not {value!r}")
+    return value
+
+def parse_criteria(specs):
+    # list of criteria objects from a list of spec dicts (or criteria objects, which are checked the same way).
+    # criteria can come from a json file or a service request, so everything that ends up in the generated code is
+    # checked here first: the attribute is a string, weight / tolerance / cap are numbers, and nothing else is given
+    if not isinstance(specs, (list, tuple)):
+        raise ValueError(f"criteria must be a list of criteria, not {type(specs).__name__}")
+    criteria = []
+    for spec in specs:
+        if isinstance(spec, (NumericMean, CategoricalMajority)):
+            spec = spec.spec()
+        if not isinstance(spec, dict):
+            raise ValueError(f"a criterion must be an object with a type and an attribute, not {spec!r}")
+        kind = spec.get('type')
+        if kind not in SPEC_KEYS:
+            raise ValueError(f"unknown criterion type {kind!r}, expected mean or majority")
+        unknown = sorted(set(spec) - set(SPEC_KEYS[kind]))
+        if unknown:
+            raise ValueError(f"unknown keys {unknown} in criterion {spec}, expected some of {list(SPEC_KEYS[kind])}")
+        attribute = spec.get('attribute')
+        if not isinstance(attribute, str) or not attribute:
+            raise ValueError(f"criterion {spec} needs an attribute, the name of a Student field or csv column")
+        weight = number(spec, "weight", spec.get('weight', 1.0))
+        if kind == "mean":
+            tolerance = spec.get('tolerance')
+            if tolerance is not None:
+                tolerance = number(spec, "tolerance", tolerance)
+            criteria.append(NumericMean(attribute, tolerance, weight))
+        else:
+            criteria.append(CategoricalMajority(attribute, number(spec, "cap", spec.get('cap', 0.5), high=1.0,
+                                                                  low_allowed=False), weight))
+    if not criteria:
+        raise ValueError("at least 1 criterion is needed")
+    seen = set()
+    for criterion in criteria:
+        if (type(criterion), criterion.attribute) in seen: # they would share 1 running aggregate in the team state
+            raise ValueError(f"{criterion.spec()['type']} criterion on {criterion.attribute!r} is given twice")
+        seen.add((type(criterion), criterion.attribute))
+    return criteria
+
+def check_criteria(criteria, students):
+    # parse_criteria, and also check the attributes against the students of 1 tut grp: every attribute must be a
+    # Student field or an extra csv column every student has a value in (a short csv row has none for the columns it
+    # lacks), and a mean needs numbers (cgpa, or a column of numbers). ValueError otherwise, before any code is
+    # generated for them
+    criteria = parse_criteria(criteria)
+    columns = list({name: None for student in students for name in student.extra or {}}) # in header order
+    for criterion in criteria:
+        attribute = criterion.attribute
+        if attribute not in STUDENT_FIELDS and attribute not in columns:
+            raise ValueError(f"criterion on unknown attribute {attribute!r}, expected one of "
+                             f"{list(STUDENT_FIELDS) + columns}")
+        if attribute in STUDENT_FIELDS:
+            if isinstance(criterion, NumericMean) and attribute != 'cgpa':
+                raise ValueError(f"mean criterion on {attribute!r}, which is not a number; only cgpa and numeric "
+                                 f"csv columns can be averaged")
+            continue
+        for student in students:
+            if attribute not in (student.extra or {}):
+                raise ValueError(f"criterion on {attribute!r}, but the row of student {student.student_id} has no "
+                                 f"value there (the row is too short)")
+            if not isinstance(criterion, NumericMean):
+                continue
+            try:
+                float(student.extra[attribute])
+            except ValueError:
+                raise ValueError(f"mean criterion on {attribute!r}, but student {student.student_id} has "
+                                 f"{student.extra[attribute]!r} there, which is not a number") from None
+    return criteria
+
+def load_criteria(filename):
+    # the criteria of a json file (a list of spec dicts), as plain spec dicts so they can go into solve options
+    with open(filename, "r", encoding="utf-8") as file:
+        return [criterion.spec() for criterion in parse_criteria(json.load(file))]
+
+def accessor(attribute, student, numeric=False):
+    # source for reading attribute off the student variable named student
+    if attribute in STUDENT_FIELDS:
+        return f"{student}.{attribute}"
+    if numeric:
+        return f"{student}.numbers[{attribute!r}]" # extra csv column as a float, see Evaluator.prepare
+    return f"{student}.extra[{attribute!r}]" # extra csv column
+
+def max_freq_after_swap(freq, key_out, key_in):
+    # the highest count in freq if 1 student with key_out leaves and 1 with key_in joins, without changing freq
+    if key_out == key_in:
+        return max(freq.values())
+    max_count = freq.get(key_in, 0) + 1
+    for key, count in freq.items():
+        if key == key_in:
+            continue # already counted above
+        if key == key_out:
+            count -= 1
+        if count > max_count:
+            max_count = count
+    return max_count
+
+def move_count(freq, key_out, key_in):
+    freq[key_out] -= 1
+    if freq[key_out] == 0:
+        del freq[key_out] # keep the dict small, a school with 0 members should not show up anymore
+    freq[key_in] = freq.get(key_in, 0) + 1
+
+def generate_source(criteria):
+    numerics = [criterion for criterion in criteria if isinstance(criterion, NumericMean)]
+    categoricals = [criterion for criterion in criteria if isinstance(criterion, CategoricalMajority)]
+    mean_of = {id(criterion): f"mean_{num}" for num, criterion in enumerate(numerics)} # criterion -> its argument
+    means = "".join(f", mean_{num}" for num in range(len(numerics)))
+    limited = [criterion for criterion in numerics if criterion.tolerance is not None]
+    sort_on = limited[0] if limited else None # the bisect attribute of the candidate buckets
+
+    def get(criterion, student):
+        return accessor(criterion.attribute, student, isinstance(criterion, NumericMean))
+
+    def as_tuple(items):
+        return "(" + ", ".join(items) + ("," if len(items) == 1 else "") + ")"
+
+    def key(criterion):
+        suffix = "_sum" if isinstance(criterion, NumericMean) else "_freq"
+        return repr(criterion.attribute + suffix)
+
+    def allowed(criterion, size):
+        # int(size * cap) in exact integer arithmetic, so eg. 0.6 of 5 is 3 and not 2.9999...
+        cap = Fraction(criterion.cap).limit_denominator(1000)
+        if cap.numerator == 1:
+            return f"{size} // {cap.denominator}"
+        return f"{size} * {cap.numerator} // {cap.denominator}"
+
+    def allowed_lines(size):
+        # 1 local per distinct cap, named so the expressions below can refer to it
+        names = {}
+        lines = []
+        for criterion in categoricals:
+            expression = allowed(criterion, size)
+            if expression not in names:
+                names[expression] = f"allowed_{len(names)}"
+                lines.append(f"    {names[expression]} = {expression}")
+        return lines, {id(criterion): names[allowed(criterion, size)] for criterion in categoricals}
+
+    def weighted(criterion, term):
+        return term if criterion.weight == 1 else f"{criterion.weight!r} * {term}"
+
+    def cost(terms, allowed_names):
+        # the sum of the imbalance terms in criteria order; terms maps a mean criterion to the team mean and a majority
+        # criterion to the highest count
+        parts = []
+        for criterion in criteria:
+            if isinstance(criterion, NumericMean):
+                parts.append(weighted(criterion, f"abs({terms[id(criterion)]} - {mean_of[id(criterion)]})"))
+            else:
+                parts.append(weighted(criterion, f"max({terms[id(criterion)]} - {allowed_names[id(criterion)]}, 0)"))
+        return " + ".join(parts)
+
+    def add_lines(state, student, indent):
+        lines = [f"{state}['size'] += 1"]
+        for criterion in numerics:
+            lines.append(f"{state}[{key(criterion)}] += {get(criterion, student)}")
+        for criterion in categoricals:
+            lines += [f"freq = {state}[{key(criterion)}]",
+                      f"value = {get(criterion, student)}",
+                      "freq[value] = freq.get(value, 0) + 1"]
+        return [indent + line for line in lines]
+
+    lines = ["def group_means(students):",
+             "    size = len(students)"]
+    for num, criterion in enumerate(numerics):
+        lines.append(f"    sum_{num} = 0.0")
+    lines.append("    for s in students:")
+    for num, criterion in enumerate(numerics):
+        lines.append(f"        sum_{num} += {get(criterion, 's')}")
+    lines.append("    return " + as_tuple([f"sum_{num} / size" for num in range(len(numerics))]))
+
+    lines += ["", "def new_state():",
+              "    return {'size': 0, " + "".join(f"{key(criterion)}: 0.0, " for criterion in numerics)
+              + "".join(f"{key(criterion)}: {{}}, " for criterion in categoricals) + "'imbalance': 0.0}"]
+
+    lines += ["", "def add_student(state, s):"] + add_lines("state", "s", "    ")
+
+    size_lines, allowed_names = allowed_lines("size")
+    lines += ["", f"def imbalance(state{means}):",
+              "    size = state['size']",
+              "    if size == 0:",
+              "        return 0.0"] + size_lines
+    lines.append("    return " + cost({**{id(criterion): f"state[{key(criterion)}] / size" for criterion in numerics},
+                                      **{id(criterion): f"max(state[{key(criterion)}].values())" for criterion in categoricals}},
+                                     allowed_names))
+
+    lines += ["", f"def init_state(team{means}):",
+              "    state = new_state()",
+              "    for s in team:"] + add_lines("state", "s", "        ") + [
+              f"    state['imbalance'] = imbalance(state{means})",
+              "    return state"]
+
+    lines += ["", f"def team_imbalance(team{means}):",
+              f"    return init_state(team{means})['imbalance']"]
+
+    lines += ["", f"def imbalance_after_swap(state, s_out, s_in{means}):",
+              "    size = state['size']"] + size_lines
+    lines.append("    return " + cost({
+        **{id(criterion): f"(state[{key(criterion)}] - {get(criterion, 's_out')} + {get(criterion, 's_in')}) / size"
+           for criterion in numerics},
+        **{id(criterion): f"max_freq_after_swap(state[{key(criterion)}], {get(criterion, 's_out')}, {get(criterion, 's_in')})"
+           for criterion in categoricals}}, allowed_names))
+
+    lines += ["", "def apply_swap(state, s_out, s_in, new_imbalance):"]
+    for criterion in numerics:
+        lines.append(f"    state[{key(criterion)}] += {get(criterion, 's_in')} - {get(criterion, 's_out')}")
+    for criterion in categoricals:
+        lines.append(f"    move_count(state[{key(criterion)}], {get(criterion, 's_out')}, {get(criterion, 's_in')})")
+    lines.append("    state['imbalance'] = new_imbalance")
+
+    next_lines, next_names = allowed_lines("next_size")
+    lines += ["", f"def can_add(state, s{means}):",
+              "    size = state['size']",
+              "    if size == 0:",
+              "        return True",
+              "    next_size = size + 1"]
+    for criterion in limited:
+        lines += [f"    if abs((state[{key(criterion)}] + {get(criterion, 's')}) / next_size - {mean_of[id(criterion)]}) > {criterion.tolerance!r}:",
+                  "        return False"]
+    lines += next_lines
+    for criterion in categoricals:
+        lines += [f"    freq = state[{key(criterion)}]",
+                  f"    if freq.get({get(criterion, 's')}, 0) + 1 > {next_names[id(criterion)]} or max(freq.values()) > {next_names[id(criterion)]}:",
+                  "        return False"]
+    lines.append("    return True")
+
+    # candidate index entries are (sort value, position, student); the position keeps them unique and ordered
+    bucket_key = as_tuple([get(criterion, 's') for criterion in categoricals])
+    lines += ["", "def candidate_key(s):",
+              f"    return {bucket_key}, {get(sort_on, 's') if sort_on is not None else '0.0'}"]
+
+    lines += ["", f"def eligible_ranges(index, state{means}):",
+              "    ranges = []",
+              "    size = state['size']",
+              "    if size == 0: # empty team, everyone can join",
+              "        for bucket in index.values():",
+              "            if bucket:",
+              "                ranges.append((bucket, 0, len(bucket)))",
+              "        return ranges",
+              "    next_size = size + 1"] + next_lines
+    for num, criterion in enumerate(categoricals):
+        lines.append(f"    freq_{num} = state[{key(criterion)}]")
+    if categoricals: # can_add looks at the max over the whole freq dict, a team already over a cap takes nobody
+        lines += ["    if " + " or ".join(f"max(freq_{num}.values()) > {next_names[id(criterion)]}"
+                                        for num, criterion in enumerate(categoricals)) + ":",
+                  "        return ranges"]
+    if sort_on is not None: # abs((sum + value) / next_size - mean) <= tolerance, solved for value
+        lines += [f"    low = ({mean_of[id(sort_on)]} - {sort_on.tolerance!r}) * next_size - state[{key(sort_on)}]",
+                  f"    high = ({mean_of[id(sort_on)]} + {sort_on.tolerance!r}) * next_size - state[{key(sort_on)}]"]
+    target = as_tuple([f"key_{num}" for num in range(len(categoricals))])
+    lines.append(f"    for {target}, bucket in index.items():")
+    if categoricals:
+        lines += ["        if " + " or ".join(f"freq_{num}.get(key_{num}, 0) + 1 > {next_names[id(criterion)]}"
+                                            for num, criterion in enumerate(categoricals)) + ":",
+                  "            continue"]
+    if sort_on is not None:
+        lines += ["        lo = bisect_left(bucket, (low, -1))",
+                  "        hi = bisect_right(bucket, (high, inf))"]
+    else:
+        lines += ["        lo, hi = 0, len(bucket)"]
+    others = limited[1:] # further tolerances cannot be a slice as well, their students are filtered out one by one
+    if others:
+        conditions = " and ".join(f"abs((state[{key(criterion)}] + {get(criterion, 'entry[2]')}) / next_size - "
+                                  f"{mean_of[id(criterion)]}) <= {criterion.tolerance!r}" for criterion in others)
+        lines += ["        if lo < hi:",
+                  f"            entries = [entry for entry in bucket[lo:hi] if {conditions}]",
+                  "            if entries:",
+                  "                ranges.append((entries, 0, len(entries)))"]
+    else:
+        lines += ["        if lo < hi:",
+                  "            ranges.append((bucket, lo, hi))"]
+    lines.append("    return ranges")
+    return "\n".join(lines) + "\n"
+
+GENERATED = ('group_means', 'new_state', 'add_student', 'imbalance', 'init_state', 'team_imbalance', 'imbalance_after_swap',
+             'apply_swap', 'can_add', 'candidate_key', 'eligible_ranges')
+
+class Evaluator:
+    # the compiled form of a list of criteria, see compile_criteria
+    def __init__(self, criteria):
+        self.criteria = parse_criteria(criteria)
+        self.source = generate_source(self.criteria) # kept for debugging: print(evaluator.source)
+        namespace = {'max_freq_after_swap': max_freq_after_swap, 'move_count': move_count, 'bisect_left': bisect_left,
+                     'bisect_right': bisect_right, 'inf': float("inf")}
+        exec(compile(self.source, "<criteria>", "exec"), namespace)
+        for name in GENERATED:
+            setattr(self, name, namespace[name])
+        # numeric extra csv columns are read as text, prepare gives every student their floats
+        self.numeric_extras = [criterion.attribute for criterion in self.criteria
+                               if isinstance(criterion, NumericMean) and criterion.attribute not in STUDENT_FIELDS]
+
+    def prepare(self, students):
+        # once per tut grp, not on every evaluation: student.numbers gets the floats, student.extra keeps the text
+        # (it is part of the record, the result cache matches students on it)
+        if self.numeric_extras:
+            for student in students:
+                student.numbers = {attribute: float(student.extra[attribute]) for attribute in self.numeric_extras}
+
+    def total_imbalance(self, teams, *means):
+        # teams can have come back from a worker process, which does not send numbers along, so prepare them here
+        self.prepare([student for team in teams for student in team])
+        return sum(self.team_imbalance(team, *means) for team in teams)
+
+_compiled = {} # json of the criteria -> Evaluator, so every tut grp of a run shares 1 compiled evaluator
+
+def compile_criteria(criteria):
+    key = json.dumps([criterion.spec() for criterion in parse_criteria(criteria)], sort_keys=True)
+    if key not in _compiled:
+        _compiled[key] = Evaluator(criteria)
+    return _compiled[key]
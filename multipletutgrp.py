@@ -1,34 +1,154 @@
 # given csv file that contains only students from tut 1 with header included:
 
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from itertools import groupby
 from pathlib import Path
+import argparse
+import csv
+import json
+import os
 import random
+import sys
+import time
+
+from criteria import CategoricalMajority, NumericMean, check_criteria, compile_criteria, load_criteria
+
+# instrumentation hooks:
+# a hook is any function hook(event, data) added with add_hook, it is called for these events:
+#   'phase' -> {'tut_group', 'phase', 'seconds'}   phase is read / form / optimise / write
+#                                                 (tut_group is None for a read of the whole file)
+#   'slot'  -> {'tut_group', 'pool_size', 'eligibility_checks', 'fallback'}   for every team slot filled in form_teams
+#   'round' -> {'tut_group', 'round', 'evaluated', 'accepted'}   for every round of the swap optimization
+#   'multi_start' -> {'tut_group', 'seed', 'attempt', 'imbalance', 'attempts_run', 'target_reached'}
+#                                                 the winning attempt of a multi start search
+#   'bound' -> {'tut_group', 'lower_bound', 'imbalance', 'gap'}   how close an optimizer got to the lower bound
+# profiling.py has a hook that collects all of these into a profile report.
+# with no hooks added, every place that could emit an event costs only an `if hooks:` check.
+
+hooks = []
+
+def add_hook(hook):
+    hooks.append(hook)
+
+def remove_hook(hook):
+    hooks.remove(hook)
+
+def emit(event, data):
+    for hook in hooks:
+        hook(event, data)
+
+def timed(phase, tut_group, function, *args, **kwargs):
+    # calls function, and reports how long it took as a 'phase' event if anyone is listening
+    if not hooks:
+        return function(*args, **kwargs)
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    emit('phase', {'tut_group': tut_group, 'phase': phase, 'seconds': time.perf_counter() - start})
+    return value
+
+# 1 student record. __slots__ means no per-student dict, which matters when there are hundreds of thousands of
+# students, and attribute lookups in the hot loops are cheaper than dict lookups.
+# school, gender and tutorial_group are interned: every "CCDS" is the same string object, so they are stored once
+# and dict lookups on them (school_freq etc.) compare by identity first.
+# team_num is the team number as an int; team_assigned gives the old "Team n" text when it is needed for output.
+# extra holds any csv columns after CGPA as {header: text} (None if there are none), for criteria.py to balance on.
+# numbers holds the ones a criterion averages as {header: float}; like team_cgpa it is filled in while solving
+# (criteria.Evaluator.prepare), extra itself is never changed.
+
+class Student:
+    __slots__ = ('tutorial_group', 'student_id', 'school', 'name', 'gender', 'cgpa', 'team_cgpa', 'team_num', 'extra', 'numbers')
+
+    def __init__(self, tutorial_group, student_id, school, name, gender, cgpa, team_cgpa=0.0, team_num=0, extra=None):
+        self.tutorial_group = sys.intern(tutorial_group)
+        self.student_id = student_id
+        self.school = sys.intern(school)
+        self.name = name
+        self.gender = sys.intern(gender)
+        self.cgpa = cgpa
+        self.team_cgpa = team_cgpa # initialize future team's average cgpa
+        self.team_num = team_num # initialize future team number
+        self.extra = extra
+        self.numbers = None
+
+    @property
+    def team_assigned(self):
+        return f"Team {self.team_num}"
+
+    def as_dict(self):
+        # the old dict form of a student, for the notebook and anything else that wants plain dicts
+        return {
+            'tutorial_group': self.tutorial_group,
+            'student_id': self.student_id,
+            'school': self.school,
+            'name': self.name,
+            'gender': self.gender,
+            'cgpa': self.cgpa,
+            'team_cgpa': self.team_cgpa,
+            'team_assigned': self.team_assigned
+        }
+
+    def __reduce__(self):
+        # pickle through __init__ so that students coming back from a worker process get interned again
+        return (Student, (self.tutorial_group, self.student_id, self.school, self.name, self.gender, self.cgpa,
+                          self.team_cgpa, self.team_num, self.extra))
+
+    def __repr__(self):
+        return f"Student({self.as_dict()!r})"
+
+def parse_student_row(row, extra_names=()):
+    # row is 1 parsed csv row, for eg: [G-1, 2417, CCDS, Truong Minh Chau, Female, 4.02]
+    # extra_names are the headers of any columns after CGPA, their values go into student.extra
+    extra = dict(zip(extra_names, row[6:])) if extra_names else None
+    return Student(row[0], row[1], row[2], row[3], row[4], float(row[5]), extra=extra) # convert cgpa to float
 
 def read_student_records(filename):
+    # filename can also be a binary snapshot made with snapshot.py, which skips the csv parsing (but still builds
+    # every Student; to load only some tut grps use snapshot.read_snapshot_tut_grp). a stale snapshot is refused
     file_path = Path(__file__).parent / filename
+    if file_path.suffix != ".csv":
+        from snapshot import is_snapshot, read_snapshot # imported here, snapshot.py itself imports from this file
+        if is_snapshot(file_path):
+            return read_snapshot(file_path)
     tut_grps = {}
-    with file_path.open("r", encoding="utf-8") as file:
-        # students = [] # initialise an empty list "students" to store each student row as dicts later
-        file.readline() # skip the header
-        for line in file: # for each row in the file
-            row = line.split(',') # each row now contains lists for each col. for eg: [G-1], [2417], [Truong Minh Chau], ...
-            student = { # creating a dict for each student
-                'tutorial_group': row[0],
-                'student_id': row[1],
-                'school': row[2],
-                'name': row[3],
-                'gender': row[4],
-                'cgpa': float(row[5]), # convert cgpa to float
-                'team_cgpa': float(0), # initialize future team's average cgpa
-                'team_assigned': "Team 0" # initialize future team number
-            }
-            
-            tut_grp = student['tutorial_group']
+    with file_path.open("r", encoding="utf-8", newline="") as file:
+        reader = csv.reader(file) # real csv parsing, so a quoted name with a comma in it stays 1 column
+        extra_names = next(reader)[6:] # skip the header, but keep the names of any extra columns
+        for row in reader: # for each row in the file
+            if not row:
+                continue # blank line, eg. at the end of the file
+            student = parse_student_row(row, extra_names)
+
+            tut_grp = student.tutorial_group
             if tut_grp not in tut_grps:
                 tut_grps[tut_grp] = []
             tut_grps[tut_grp].append(student)
 
     return tut_grps
 
+def iter_tut_grps(filename):
+    # streaming version of read_student_records: yields (tut grp, students) 1 tut grp at a time, so only 1 tut grp
+    # is in memory at once. this needs the file to be grouped, ie. all rows of a tut grp next to each other,
+    # like records.csv is. a tut grp that shows up again later is an error instead of silently becoming 2 tut grps.
+    file_path = Path(__file__).parent / filename
+    if file_path.suffix != ".csv":
+        from snapshot import is_snapshot, iter_snapshot_tut_grps
+        if is_snapshot(file_path):
+            yield from iter_snapshot_tut_grps(file_path)
+            return
+    seen = set()
+    with file_path.open("r", encoding="utf-8", newline="") as file:
+        reader = csv.reader(file)
+        extra_names = next(reader)[6:] # skip the header
+        rows = (row for row in reader if row)
+        for tut_grp, grp_rows in groupby(rows, key=lambda row: row[0]):
+            if tut_grp in seen:
+                raise ValueError(f"{filename} is not grouped by tutorial group: {tut_grp} appears again after other groups")
+            seen.add(tut_grp)
+            yield tut_grp, [parse_student_row(row, extra_names) for row in grp_rows]
+
 # logic for code:
 
 # calculate avg cgpa for the tut group -> initialize teams -> assign students to teams
@@ -36,7 +156,7 @@ def read_student_records(filename):
 def calc_avg_cgpa(students):
     total_cgpa = student_count = float(0)
     for student in students: # iterate the list
-        total_cgpa += student['cgpa']
+        total_cgpa += student.cgpa
         student_count += 1
     avg_cgpa = total_cgpa / student_count
     return avg_cgpa
@@ -51,8 +171,8 @@ def calc_avg_cgpa(students):
 # repeat for team 2,...
 # repeat until all students are added
 
-# inputs will be students: the list of dicts
-# we want to output the student dict as stated above with mean cgpa and team assigned included
+# inputs will be students: the list of Student records
+# we want to output the Student records as stated above with mean cgpa and team assigned included
 # target:
 # tut grp 1: [
 #               team1: [{student1}, {student2}, ..., {student5}], 
@@ -62,190 +182,668 @@ def calc_avg_cgpa(students):
 # tut grp 2: ...
 # initialize list for team 1 to n
 
+TEAM_SIZE = 5 # students per team
+CGPA_TOLERANCE = 0.5 # how far a team's avg cgpa may be from the tut grp's avg cgpa
+
+# the balancing rules, written as criteria (see criteria.py):
+#   - cgpa: a team's avg cgpa has to stay within CGPA_TOLERANCE of the tut grp's, and the distance is its imbalance
+#   - school, which is essentially a frequency algorithm: no school may have more than half of a team; how many a
+#     school is over half is its imbalance (eg. max= 3 - 2; if max is only 2, then 2-2 means no imbalance basically)
+#   - gender: same logic as school
+# RULES is these criteria compiled into plain python, once at import. the functions below are that generated code,
+# so forming teams, the swap optimization and a --criteria run all evaluate the rules the same way;
+# print(RULES.source) shows it. every one of them takes the tut grp's avg cgpa as its last argument (the mean of the
+# 1 mean criterion); the running team state is {'size', 'cgpa_sum', 'school_freq', 'gender_freq', 'imbalance'}.
+
+DEFAULT_CRITERIA = [NumericMean("cgpa", CGPA_TOLERANCE), CategoricalMajority("school"), CategoricalMajority("gender")]
+RULES = compile_criteria(DEFAULT_CRITERIA)
+
 def can_add_student(student, team, tut_avg_cgpa):
-    if len(team) == 0:
-        return True
-
-    next_team_size = len(team) + 1
-
-    # cgpa criteria
-    curr_total_cgpa = 0
-    for member in team:
-        curr_total_cgpa += member['cgpa']
-    next_total_cgpa = curr_total_cgpa + student['cgpa']
-    next_avg_cgpa = next_total_cgpa / next_team_size
-    if abs(next_avg_cgpa - tut_avg_cgpa) > 0.5:
-        return False
-    
-    # school criteria, which is essentially a frequency algorithm
-    school_freq = {} # dict for key = school, value = frequency/count
-    for member in team:
-        school_freq[member['school']] = school_freq.get(member['school'], 0) + 1 # if dont have, return 0+1
-    school_freq[student['school']] = school_freq.get(student['school'], 0) + 1 # add the student's school into the freq
-    if max(school_freq.values()) > next_team_size // 2:
-        return False
-    
-    # gender criteria
-    gender_freq = {}
-    for member in team:
-        gender_freq[member['gender']] = gender_freq.get(member['gender'], 0) + 1
-    gender_freq[student['gender']] = gender_freq.get(student['gender'], 0) + 1 # add the student's gender into the freq
-    if max(gender_freq.values()) > next_team_size // 2:
-        return False
-
-    return True
-
-def form_teams(students):
-    tut_avg_cgpa = calc_avg_cgpa(students)
-    team_size = 5
-    num_of_teams = len(students) // team_size
+    return RULES.can_add(RULES.init_state(team, tut_avg_cgpa), student, tut_avg_cgpa)
+
+calculate_team_imbalance = RULES.team_imbalance # (team, tut_avg_cgpa): simply the sum of the 3 terms for that team
+init_team_state = RULES.init_state # (team, tut_avg_cgpa): the running state of a team, imbalance included
+add_to_team_state = RULES.add_student # (state, student)
+
+# candidate index for forming teams:
+# instead of running can_add_student on every remaining candidate for every slot, the candidates are put into
+# buckets by (school, gender), and every bucket is kept sorted by cgpa. for a team we then know
+#   - from its running school / gender counts which buckets are allowed at all
+#   - from its running cgpa sum which cgpa range keeps the team avg within 0.5 of the tut avg
+# so the eligible students of a bucket are 1 contiguous slice found with bisect, no full scan needed.
+# with other criteria the buckets are by their majority attributes and sorted on their first mean with a tolerance.
+
+def build_candidate_index(candidates, rules=RULES):
+    # bucket entries are (cgpa, position in the shuffled candidates list, student); the position keeps entries unique
+    # and lets the fallback still take "the last person in the list" like candidates.pop() did
+    index = {}
+    for position, student in enumerate(candidates):
+        key, value = rules.candidate_key(student)
+        if key not in index:
+            index[key] = []
+        index[key].append((value, position, student))
+    for bucket in index.values():
+        bucket.sort()
+    return index
+
+def remove_from_index(index, student, position, rules=RULES):
+    key, value = rules.candidate_key(student)
+    bucket = index[key]
+    del bucket[bisect_left(bucket, (value, position))]
+
+eligible_ranges = RULES.eligible_ranges # (index, state, tut_avg_cgpa): can_add_student answered per bucket
+
+def form_teams(students, rng=random, rules=RULES):
+    # rng can be a seeded random.Random so that a group can be reproduced on its own (eg. inside a worker process)
+    # rules is a compiled criteria.Evaluator, the built in rules unless a --criteria run passes its own
+    rules.prepare(students)
+    group_means = rules.group_means(students) # (tut_avg_cgpa,) for the built in rules
+    team_size = TEAM_SIZE
+    num_of_teams = max(1, len(students) // team_size) # a tut grp smaller than 1 team still gets 1 team instead of looping forever
     teams = [ [] for _ in range(num_of_teams)]
+    states = [rules.new_state() for _ in range(num_of_teams)]
 
-    candidates = students.copy() # dont change the original list; to pop the list later
-    random.shuffle(candidates) # randomize the copied list
+    candidates = students.copy() # dont change the original list
+    rng.shuffle(candidates) # randomize the copied list
+    index = build_candidate_index(candidates, rules)
+    taken = [False] * len(candidates)
+    last = len(candidates) - 1 # the fallback takes the last candidate in the shuffled list that is still free
+    remaining = len(candidates)
 
-    while len(candidates) != 0: # once again, candidates is the list of student dicts in the tut grp
+    while remaining != 0:
         team_num = 0
-        for team in teams: # interate through every teams as we are adding 1 student to every team for 1 round
+        for team, state in zip(teams, states): # interate through every teams as we are adding 1 student to every team for 1 round
             team_num += 1
-            candidate_pool = [] # we will always have a new list / pool of students to choose from for each team
-            
-            for student in candidates: # to get the candidate pool
-                if can_add_student(student, team, tut_avg_cgpa):
-                    candidate_pool.append(student)
-            
-            if len(candidate_pool) != 0: # simply select a random students from the list of eligible students to add
-                selected_student = random.choice(candidate_pool)
-                team.append(selected_student)
-                candidates.remove(selected_student)
-                selected_student['team_assigned'] = f'Team {team_num}'
-
-            elif len(candidate_pool) == 0: # select from the candidates list if pool is empty
-                selected_student = candidates.pop() # returns removed student, who is the last person in list
-                team.append(selected_student)
-                selected_student['team_assigned'] = f'Team {team_num}'
+            if remaining == 0: # the last round may not reach every team
+                break
+
+            ranges = rules.eligible_ranges(index, state, *group_means)
+            pool_size = sum(hi - lo for _, lo, hi in ranges)
+
+            if pool_size != 0: # simply select a random student from all the eligible students to add
+                pick = rng.randrange(pool_size)
+                for bucket, lo, hi in ranges:
+                    if pick < hi - lo:
+                        position = bucket[lo + pick][1]
+                        break
+                    pick -= hi - lo
+
+            else: # select the last free candidate in the shuffled list if nobody is eligible
+                while taken[last]:
+                    last -= 1
+                position = last
+
+            if hooks: # every bucket checked is what used to be can_add_student calls
+                emit('slot', {'tut_group': students[0].tutorial_group, 'pool_size': pool_size,
+                              'eligibility_checks': len(index), 'fallback': pool_size == 0})
+
+            selected_student = candidates[position]
+            taken[position] = True
+            remove_from_index(index, selected_student, position, rules)
+            remaining -= 1
+            team.append(selected_student)
+            rules.add_student(state, selected_student)
+            selected_student.team_num = team_num
 
     for team in teams:
+        team_cgpa = calc_avg_cgpa(team) # get team cgpa
         for student in team:
-            student['team_cgpa'] = calc_avg_cgpa(team) # get team cgpa
+            student.team_cgpa = team_cgpa
 
     return teams
 
 # implement a post-processing optimization algorithm that can further refine team balance by slightly adjusting student allocations
 # pairwise swap optimization algorithm. iteratively swapping students between teams to see if these swaps improve team balance
 
-def calculate_team_imbalance(team, tut_avg_cgpa):
-    # calc cgpa imbalance
-    team_cgpa = calc_avg_cgpa(team)
-    cgpa_imbalance = abs(team_cgpa - tut_avg_cgpa)
-
-    # calc school imbalance: eg max= 3 - 2; if max is only 2, then 2-2 means no imbalance basically; 
-    # however, if 1 of each school, need to account for negative
-    school_freq = {}
-    for student in team:
-        school_freq[student['school']] = school_freq.get(student['school'], 0) + 1
-    max_school_count = max(school_freq.values())
-    school_imbalance = max_school_count - (len(team) // 2)
-    if school_imbalance < 0:
-        school_imbalance = 0
-
-    # calc gender imbalance: same logic as school calc
-    gender_freq = {}
-    for student in team:
-        gender_freq[student['gender']] = gender_freq.get(student['gender'], 0) + 1
-    max_gender_count = max(gender_freq.values())
-    gender_imbalance = max_gender_count - (len(team) // 2)
-    if gender_imbalance < 0:
-        gender_imbalance = 0
-
-    # simply return the sum for that team of 5
-    return cgpa_imbalance + school_imbalance + gender_imbalance
+# running team state for the swap optimization:
+# calculate_team_imbalance rebuilds the mean cgpa and both freq dicts every time it is called, which is a lot of
+# repeated work when we only want to know what 1 swap would do. instead every team keeps a running
+# cgpa sum and school / gender counts, so the cost of a proposed swap is simple arithmetic on those numbers.
+# the team lists are only touched when a swap is actually accepted.
+
+SWAP_EPSILON = 1e-9 # a swap has to improve by more than float noise, otherwise equal swaps could flip back and forth
+
+imbalance_after_swap = RULES.imbalance_after_swap # (state, student_out, student_in, tut_avg_cgpa), teams not changed
+apply_swap = RULES.apply_swap # (state, student_out, student_in, new_imbalance)
+
+# lower bound on the total imbalance of a tut grp:
+# no assignment can do better than this, so once an optimizer is (nearly) there it can stop searching.
+# it uses the same 3 terms as calculate_team_imbalance, each bounded on its own:
+#   - school / gender: a team of size s out of k categories always has at least ceil(s / k) of one category, which
+#     costs ceil(s / k) - s // 2 if that is above 0 (eg. 5 students, 2 genders -> 3 of one gender -> 1). on top of
+#     that, a category with more students than all teams can take without extra cost (s // 2 + that minimum, summed
+#     over the teams) costs 1 for every student over that
+#   - cgpa: whichever team gets the highest cgpa student has a mean of at least
+#     (highest + (s - 1) * lowest) / s for the biggest team size s, and the same the other way round for the lowest
+# the cgpa term is usually 0 for a well mixed tut grp, so optimizers stop once they are within BOUND_TOLERANCE per
+# team of the bound; a team cgpa that is 0.005 off is not even visible in the 2 decimals of the output.
+
+BOUND_TOLERANCE = 0.005
+
+def category_lower_bound(category_counts, team_sizes):
+    # category_counts: number of students of every school (or every gender) in the tut grp
+    num_categories = len(category_counts)
+    team_floors = [max(0, -(-size // num_categories) - size // 2) for size in team_sizes] # -(-a // b) is ceil(a / b)
+    free_places = sum(size // 2 + floor for size, floor in zip(team_sizes, team_floors))
+    return sum(team_floors) + max(0, max(category_counts) - free_places)
+
+def formed_team_sizes(num_of_students):
+    # the team sizes form_teams ends up with: students are dealt round robin, so the first teams get the extra ones
+    num_of_teams = max(1, num_of_students // TEAM_SIZE)
+    extra = num_of_students % num_of_teams
+    return [num_of_students // num_of_teams + (1 if team_num < extra else 0) for team_num in range(num_of_teams)]
+
+def imbalance_lower_bound(students, team_sizes, tut_avg_cgpa):
+    if not students or not team_sizes:
+        return 0.0 # nothing to balance
+    school_counts = {}
+    gender_counts = {}
+    for student in students:
+        school_counts[student.school] = school_counts.get(student.school, 0) + 1
+        gender_counts[student.gender] = gender_counts.get(student.gender, 0) + 1
+
+    max_size = max(team_sizes)
+    highest = max(student.cgpa for student in students)
+    lowest = min(student.cgpa for student in students)
+    cgpa_bound = max(0.0, (highest + (max_size - 1) * lowest) / max_size - tut_avg_cgpa,
+                     tut_avg_cgpa - (lowest + (max_size - 1) * highest) / max_size)
+
+    return cgpa_bound + category_lower_bound(list(school_counts.values()), team_sizes) \
+        + category_lower_bound(list(gender_counts.values()), team_sizes)
+
+def stop_imbalance(teams, tut_avg_cgpa):
+    # (lower bound, total imbalance at which an optimizer may stop), (0.0, 0.0) for no teams
+    students = [student for team in teams for student in team]
+    if not students:
+        return 0.0, 0.0
+    lower_bound = imbalance_lower_bound(students, [len(team) for team in teams], tut_avg_cgpa)
+    return lower_bound, lower_bound + BOUND_TOLERANCE * len(teams)
+
+def report_bound(teams, tut_avg_cgpa, lower_bound):
+    # 'bound' event: how far the final teams are from the lower bound
+    if hooks and teams:
+        imbalance = sum(calculate_team_imbalance(team, tut_avg_cgpa) for team in teams)
+        emit('bound', {'tut_group': teams[0][0].tutorial_group, 'lower_bound': lower_bound, 'imbalance': imbalance,
+                       'gap': imbalance - lower_bound})
+
+NUMPY_MIN_TEAMS = 20 # big tut grps go to the numpy backend in numpy_swaps.py, which is several times faster there
+
+def swap_round(teams, states, group_means, total, stop_at, score=imbalance_after_swap, apply=apply_swap):
+    # one iteration of the outer loop attempts all possible swaps between all team pairs
+    # returns (accepted swaps, evaluated swaps, total imbalance afterwards); ends early once total reaches stop_at
+    # score / apply are the state functions of the rules, group_means the tut grp means they compare against:
+    # (tut_avg_cgpa,) for the built in rules, rules.group_means(students) for other criteria
+    accepted = evaluated = 0
+    for i in range(len(teams)):
+        for j in range(i + 1, len(teams)):
+            team1, team2 = teams[i], teams[j]
+            state1, state2 = states[i], states[j]
+            evaluated += len(team1) * len(team2)
+
+            for a in range(len(team1)):
+                for b in range(len(team2)):
+                    student1, student2 = team1[a], team2[b]
+
+                    # imbalance of both teams if student1 and student2 were swapped, the teams are not changed yet
+                    new_team1_imbalance = score(state1, student1, student2, *group_means)
+                    new_team2_imbalance = score(state2, student2, student1, *group_means)
+                    change = new_team1_imbalance + new_team2_imbalance - state1['imbalance'] - state2['imbalance']
+
+                    # Check if swap improves team balance compared to before the swap, only then apply it
+                    if change < -SWAP_EPSILON:
+                        team1[a], team2[b] = student2, student1 # swap in place, so the loops keep walking the same slots
+                        apply(state1, student1, student2, new_team1_imbalance)
+                        apply(state2, student2, student1, new_team2_imbalance)
+                        accepted += 1
+                        total += change
+                        if total <= stop_at: # as good as it gets, no point looking further
+                            return accepted, evaluated, total
+    return accepted, evaluated, total
 
 def optimize_teams(teams, tut_avg_cgpa, max_rounds):
-    # one iteration of the outer loop attempts all possible swaps between all team pairs 
-    # evaluate whether any of these swaps improve balance
-    for _ in range(max_rounds): # we simply want to run for a specific number of times, so _ is used just for iteration
-        improved = False
-
-        for i in range(len(teams)):
-            for j in range(i + 1, len(teams)):
-                team1, team2 = teams[i], teams[j]
-
-                for student1 in team1:
-                    for student2 in team2:
-                        # Swap students and calculate new imbalance
-                        team1.remove(student1)
-                        team2.remove(student2)
-                        team1.append(student2)
-                        team2.append(student1)
-
-                        new_team1_imbalance = calculate_team_imbalance(team1, tut_avg_cgpa)
-                        new_team2_imbalance = calculate_team_imbalance(team2, tut_avg_cgpa)
-
-                        # Check if swap improves team balance
-                        if new_team1_imbalance + new_team2_imbalance < calculate_team_imbalance(team1, tut_avg_cgpa) + calculate_team_imbalance(team2, tut_avg_cgpa):
-                            improved = True
-                        else:
-                            # Revert swap if no improvement
-                            team1.remove(student2)
-                            team2.remove(student1)
-                            team1.append(student1)
-                            team2.append(student2)
+    if len(teams) >= NUMPY_MIN_TEAMS:
+        try:
+            from numpy_swaps import optimize_teams_numpy
+        except ImportError: # no numpy installed, stay with the pure python version below
+            pass
+        else:
+            return optimize_teams_numpy(teams, tut_avg_cgpa, max_rounds)
+
+    # evaluate whether any of the swaps improve balance, round after round, until none does or the bound is reached
+    states = [init_team_state(team, tut_avg_cgpa) for team in teams]
+    lower_bound, stop_at = stop_imbalance(teams, tut_avg_cgpa)
+    total = sum(state['imbalance'] for state in states)
+
+    for round_num in range(max_rounds): # we simply want to run for a specific number of times
+        if total <= stop_at:
+            break
+        accepted, evaluated, total = swap_round(teams, states, (tut_avg_cgpa,), total, stop_at)
+
+        if hooks:
+            emit('round', {'tut_group': teams[0][0].tutorial_group, 'round': round_num + 1, 'evaluated': evaluated, 'accepted': accepted})
+
+        # Stop if no further improvements
+        if accepted == 0:
+            break
+
+    refresh_team_fields(teams)
+    report_bound(teams, tut_avg_cgpa, lower_bound)
+    return teams
+
+def optimize_teams_criteria(teams, rules, max_rounds):
+    # optimize_teams for any compiled criteria: the same swap rounds, scored by rules. no numpy backend and no lower
+    # bound, both only know the built in rules
+    students = [student for team in teams for student in team]
+    rules.prepare(students)
+    group_means = rules.group_means(students)
+    states = [rules.init_state(team, *group_means) for team in teams]
+    total = sum(state['imbalance'] for state in states)
+
+    for round_num in range(max_rounds):
+        accepted, evaluated, total = swap_round(teams, states, group_means, total, -float("inf"),
+                                                rules.imbalance_after_swap, rules.apply_swap)
+        if hooks:
+            emit('round', {'tut_group': teams[0][0].tutorial_group, 'round': round_num + 1, 'evaluated': evaluated, 'accepted': accepted})
 
         # Stop if no further improvements
-        if not improved:
+        if accepted == 0:
             break
 
+    refresh_team_fields(teams)
     return teams
 
-def write_student_records(tut_grps):
-    output_rows = []
-    
-    # Prepare header row
-    output_rows.append("Tutorial Group,Student ID,School,Name,Gender,CGPA,Team CGPA,Team Assigned")
-    
+def refresh_team_fields(teams):
+    # students may have changed teams, so their team cgpa and team number have to be refreshed
+    team_num = 0
+    for team in teams:
+        team_num += 1
+        team_cgpa = calc_avg_cgpa(team)
+        for student in team:
+            student.team_cgpa = team_cgpa
+            student.team_num = team_num
+
+OUTPUT_HEADER = ["Tutorial Group", "Student ID", "School", "Name", "Gender", "CGPA", "Team CGPA", "Team Assigned"]
+
+def open_output(filename):
+    output_file_path = Path(__file__).parent / filename
+    file = output_file_path.open("w", encoding="utf-8", newline="")
+    writer = csv.writer(file, lineterminator="\n") # names with commas or quotes get quoted instead of breaking the row
+    writer.writerow(OUTPUT_HEADER)
+    return file, writer
+
+def output_row(student):
+    return [
+        student.tutorial_group,
+        student.student_id,
+        student.school,
+        student.name,
+        student.gender,
+        f"{student.cgpa:.2f}",
+        f"{student.team_cgpa:.2f}",
+        student.team_assigned
+    ]
+
+def write_tut_grp_rows(writer, teams, counter):
     ############ final changes
-    team_num = 1
-    count = 0
+    # counter = {'team_num': ..} is carried from 1 tut grp to the next
     ############ we want the teams to increment without resetting after each tut grp
+    # the number goes up once per actual team, not every TEAM_SIZE rows: a tut grp of 52 has teams of 6, 6, 5, ...
+    # and rebalance.py / evaluate.py read the "Team n" column back as team membership
+    for team in teams:
+        for student in team:
+            ############ final changes
+            student.team_num = counter['team_num']
+            ############ we want the teams to increment without resetting after each tut grp
+
+            writer.writerow(output_row(student)) # write 1 row for each student
+        counter['team_num'] += 1
+
+def write_student_records(tut_grps, filename="balanced_teams.csv"):
+    file, writer = open_output(filename)
+    counter = {'team_num': 1}
+    with file:
+        for tut_grp, teams in tut_grps.items():
+            timed('write', tut_grp, write_tut_grp_rows, writer, teams, counter)
+
+# running the tut grps in parallel:
+# every tut grp is formed and optimized independently, so each one can be handed to a separate worker process.
+# to make a parallel run give the same teams as a serial run, every tut grp gets its own rng seeded from
+# (seed, tut grp name) instead of sharing the global random module, so the result no longer depends on
+# which worker ran it or in what order.
+
+def tut_grp_seed(seed, tut_group):
+    if seed is None:
+        return None # no seed given -> fresh randomness every run, same as before
+    return f"{seed}:{tut_group}" # str seeds are hashed deterministically by random.Random, across processes too
+
+OPTIMIZERS = ["swap", "anneal", "neighbourhood"]
+
+def solve_tut_grp(students, seed=None, max_rounds=100, optimizer="swap", time_budget=None, max_evaluations=None,
+                  attempts=1, target_imbalance=None, criteria=None):
+    # optimizer "swap" is the pairwise swap optimization above, "anneal" is the budgeted search in annealing.py,
+    # "neighbourhood" is the swap optimization restricted to promising team pairs in neighbourhood.py (for huge tut grps)
+    # attempts > 1 runs a multi start search, see multi_start_tut_grp
+    # criteria is a list of balancing rules for criteria.py, None means the built in cgpa / school / gender rules
+    if attempts > 1:
+        return multi_start_tut_grp(students, seed, attempts, target_imbalance, max_rounds=max_rounds, optimizer=optimizer,
+                                   time_budget=time_budget, max_evaluations=max_evaluations, criteria=criteria)[0]
+    rng = random.Random(seed)
+    tut_group = students[0].tutorial_group
+    rules = RULES if criteria is None else compile_criteria(check_criteria(criteria, students))
+    if rules is not RULES: # criteria that are just the built in rules compile to RULES itself and take the normal path
+        if optimizer != "swap":
+            raise ValueError(f"criteria only work with the swap optimizer, not {optimizer!r}")
+        teams = timed('form', tut_group, form_teams, students, rng, rules)
+        return timed('optimise', tut_group, optimize_teams_criteria, teams, rules, max_rounds)
+    teams = timed('form', tut_group, form_teams, students, rng)
+    tut_avg_cgpa = calc_avg_cgpa(students) # to get the whole tut grp's cgpa for compare
+    if optimizer == "anneal":
+        from annealing import anneal_teams # imported here, annealing.py itself imports from this file
+        if time_budget is None and max_evaluations is None:
+            return timed('optimise', tut_group, anneal_teams, teams, tut_avg_cgpa, rng=rng)
+        return timed('optimise', tut_group, anneal_teams, teams, tut_avg_cgpa, time_budget=time_budget,
+                     max_evaluations=max_evaluations, rng=rng)
+    if optimizer == "neighbourhood":
+        from neighbourhood import optimize_teams_neighbourhood
+        return timed('optimise', tut_group, optimize_teams_neighbourhood, teams, tut_avg_cgpa, max_rounds)
+    return timed('optimise', tut_group, optimize_teams, teams, tut_avg_cgpa, max_rounds)
+
+# multi start search:
+# where optimize_teams ends up depends a lot on the random shuffle in form_teams, so instead of 1 attempt we make
+# several, each with its own seed, and keep the attempt with the lowest total imbalance (the lowest attempt number
+# wins a tie). every attempt is an ordinary solve_tut_grp call with seed "<tut grp seed>/<attempt>", so the winning
+# seed is all that is needed to reproduce a result exactly: solve_tut_grp(students, seed=winning_seed).
+# with target_imbalance, the search stops as soon as an attempt is at or below it; without one it stops once an
+# attempt is within BOUND_TOLERANCE per team of the lower bound, since no other attempt could do meaningfully better.
+
+def attempt_seeds(seed, attempts):
+    if seed is None:
+        seed = f"{random.getrandbits(64):016x}" # pick a seed anyway, otherwise the result could not be reproduced
+    return [f"{seed}/{attempt}" for attempt in range(attempts)]
+
+def total_imbalance(teams, tut_avg_cgpa):
+    return sum(calculate_team_imbalance(team, tut_avg_cgpa) for team in teams)
+
+def multi_start_tut_grp(students, seed=None, attempts=4, target_imbalance=None, workers=1, **options):
+    # returns (teams, info) where info is the 'multi_start' event data. workers > 1 runs the attempts in a process pool
+    tut_group = students[0].tutorial_group
+    tut_avg_cgpa = calc_avg_cgpa(students)
+    seeds = attempt_seeds(seed, attempts)
+    best = None # (imbalance, attempt, teams)
+    score = total_imbalance
+    if options.get('criteria') is not None: # compare the attempts on the criteria's imbalance, there is no bound for it
+        rules = compile_criteria(check_criteria(options['criteria'], students))
+        rules.prepare(students)
+        group_means = rules.group_means(students)
+        score = lambda teams, tut_avg_cgpa: rules.total_imbalance(teams, *group_means)
+    elif target_imbalance is None: # without a target, an attempt that reaches the lower bound cannot be beaten anyway
+        team_sizes = formed_team_sizes(len(students))
+        target_imbalance = imbalance_lower_bound(students, team_sizes, tut_avg_cgpa) + BOUND_TOLERANCE * len(team_sizes)
+    attempts_run = 0
+
+    def better(imbalance, attempt):
+        return best is None or (imbalance, attempt) < (best[0], best[1])
+
+    if workers <= 1:
+        for attempt, attempt_seed in enumerate(seeds):
+            teams = solve_tut_grp(students, attempt_seed, **options)
+            imbalance = score(teams, tut_avg_cgpa)
+            attempts_run += 1
+            if better(imbalance, attempt):
+                best = (imbalance, attempt, [team[:] for team in teams]) # copy, the next attempt reuses the students
+            if target_imbalance is not None and imbalance <= target_imbalance:
+                break
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        target_reached = False
+        try:
+            futures = {executor.submit(_solve_tut_grp_job, (tut_group, students, attempt_seed, options, bool(hooks))): attempt
+                       for attempt, attempt_seed in enumerate(seeds)}
+            for future in as_completed(futures):
+                attempt = futures[future]
+                teams = _replay_events(future.result())
+                imbalance = score(teams, tut_avg_cgpa)
+                attempts_run += 1
+                if better(imbalance, attempt):
+                    best = (imbalance, attempt, teams)
+                if target_imbalance is not None and imbalance <= target_imbalance:
+                    target_reached = True
+                    break
+        finally:
+            # attempts that have not started yet are dropped; once the target is reached the ones still running are
+            # not waited for either (their workers exit when they are done), that is the point of stopping early
+            executor.shutdown(wait=not target_reached, cancel_futures=True)
+
+    imbalance, attempt, teams = best
+    refresh_team_fields(teams) # later attempts overwrote team_cgpa / team_num of the shared students
+    info = {'tut_group': tut_group, 'seed': seeds[attempt], 'attempt': attempt, 'imbalance': imbalance,
+            'attempts_run': attempts_run, 'target_reached': target_imbalance is not None and imbalance <= target_imbalance}
+    if hooks:
+        emit('multi_start', info)
+    return teams, info
+
+def _solve_tut_grp_job(job): # module level so that the process pool can pickle it
+    # record=True is used in worker processes: the hooks live in the main process, so the events are
+    # collected here and sent back together with the teams, see _replay_events
+    tut_group, students, seed, options, record = job
+    if not record:
+        return solve_tut_grp(students, seed, **options), None
+    events = []
+    def recorder(event, data):
+        events.append((event, data))
+    add_hook(recorder)
+    try:
+        return solve_tut_grp(students, seed, **options), events
+    finally:
+        remove_hook(recorder)
+
+def _replay_events(result):
+    teams, events = result
+    for event, data in events or ():
+        emit(event, data)
+    return teams
 
-    # Prepare data rows
-    for tut_grp, teams in tut_grps.items():
-        for team in teams:
-            for student in team:
-                ############ final changes
-                student['team_assigned'] = f"Team {team_num}"
-                count += 1
-                if count == 5:
-                    team_num += 1
-                    count = 0
-                ############ we want the teams to increment without resetting after each tut grp
-
-                # Create a comma-separated row for each student
-                output_row = ",".join([
-                    student['tutorial_group'],
-                    student['student_id'],
-                    student['school'],
-                    student['name'],
-                    student['gender'],
-                    f"{student['cgpa']:.2f}",
-                    f"{student['team_cgpa']:.2f}",
-                    student['team_assigned']
-                ])
-                output_rows.append(output_row)
-
-    output_file_path = Path(__file__).parent / "balanced_teams.csv"
-    with output_file_path.open("w", encoding="utf-8") as file:
-        for row in output_rows:
-            file.write(row + "\n")
-
-
-all_students = read_student_records("records.csv")
-optimized_tut_grps = {}
-
-for tut_group, students in all_students.items():
-    teams = form_teams(students)
-    optimized_teams = optimize_teams(teams, calc_avg_cgpa(students), max_rounds=100) # to get the whole tut grp's cgpa for compare
-    optimized_tut_grps[tut_group] = optimized_teams
-
-write_student_records(optimized_tut_grps)
\ No newline at end of file
+def timed_tut_grps(tut_grps):
+    # wraps iter_tut_grps so that reading every tut grp is reported as its own 'read' phase
+    iterator = iter(tut_grps)
+    while True:
+        start = time.perf_counter() if hooks else 0.0
+        try:
+            tut_group, students = next(iterator)
+        except StopIteration:
+            return
+        if hooks:
+            emit('phase', {'tut_group': tut_group, 'phase': 'read', 'seconds': time.perf_counter() - start})
+        yield tut_group, students
+
+def cached_teams(cache, students, seed, options):
+    # (key, teams) from the result cache in result_cache.py, teams is None on a miss or without a cache
+    if cache is None:
+        return None, None
+    key = cache.key(students, seed, options)
+    entry = cache.get(key, students)
+    if entry is None:
+        return key, None
+    teams, multi_start = entry
+    if multi_start is not None and hooks: # a reused multi start result still reports its winning seed
+        emit('multi_start', multi_start)
+    return key, teams
+
+@contextmanager
+def winning_attempts(cache, options):
+    # tut grp -> 'multi_start' event of every tut grp solved inside the block, so cache.put can store the winning
+    # seed with the teams. only collected when there is a cache and a multi start search
+    winners = {}
+    if cache is None or options.get('attempts', 1) <= 1:
+        yield winners
+        return
+    def keep(event, data):
+        if event == 'multi_start':
+            winners[data['tut_group']] = data
+    add_hook(keep)
+    try:
+        yield winners
+    finally:
+        remove_hook(keep)
+
+def solve_tut_grps(all_students, workers=1, seed=None, cache=None, **options):
+    # options are passed on to solve_tut_grp for every tut grp (max_rounds, optimizer, time_budget, ...)
+    # with a cache (a ResultCache), tut grps that were solved before with the same rows, seed and options are reused
+    with winning_attempts(cache, options) as winners:
+        results, keys, jobs = _solve_uncached(all_students, workers, seed, cache, options)
+
+    if cache is not None:
+        for job in jobs:
+            cache.put(keys[job[0]], job[1], results[job[0]], winners.get(job[0]))
+        cache.evict()
+    return results
+
+def _solve_uncached(all_students, workers, seed, cache, options):
+    # the work of solve_tut_grps: (results, cache keys, jobs that were actually solved)
+    results = {}
+    keys = {}
+    jobs = []
+    for tut_group, students in all_students.items():
+        group_seed = tut_grp_seed(seed, tut_group)
+        keys[tut_group], results[tut_group] = cached_teams(cache, students, group_seed, options)
+        if results[tut_group] is None:
+            jobs.append((tut_group, students, group_seed, options, False))
+
+    if workers > 1 and len(jobs) == 1 and options.get('attempts', 1) > 1:
+        # only 1 tut grp to solve, so spread its attempts over the workers instead
+        tut_group, students, group_seed = jobs[0][:3]
+        attempt_options = {key: value for key, value in options.items() if key not in ('attempts', 'target_imbalance')}
+        results[tut_group] = multi_start_tut_grp(students, group_seed, options['attempts'], options.get('target_imbalance'),
+                                                 workers, **attempt_options)[0]
+    elif workers > 1 and len(jobs) > 1:
+        # the results are collected by tut grp and returned in the order of all_students, so the tut grps stay
+        # in file order and write_student_records still numbers the teams globally exactly like a serial run
+        jobs = [job[:4] + (bool(hooks),) for job in jobs]
+        chunksize = max(1, len(jobs) // (workers * 4)) # a few chunks per worker to cut down on pickling round trips
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for job, result in zip(jobs, executor.map(_solve_tut_grp_job, jobs, chunksize=chunksize)):
+                results[job[0]] = _replay_events(result)
+    else:
+        for job in jobs:
+            results[job[0]] = _replay_events(_solve_tut_grp_job(job))
+    return results, keys, jobs
+
+# streaming pipeline:
+# read 1 tut grp -> solve it -> write its rows -> forget it, so memory stays around the size of the biggest
+# tut grp instead of the whole cohort. with workers > 1 only a small window of tut grps is in flight at a time,
+# and the rows are still written in file order so the global team numbering matches a normal run.
+
+def stream_tut_grps(input_filename, output_filename="balanced_teams.csv", workers=1, seed=None, cache=None, **options):
+    file, writer = open_output(output_filename)
+    counter = {'team_num': 1}
+    with file, winning_attempts(cache, options) as winners:
+        record = workers > 1 and bool(hooks)
+        jobs = ((tut_group, students, tut_grp_seed(seed, tut_group), options, record)
+                for tut_group, students in timed_tut_grps(iter_tut_grps(input_filename)))
+
+        def write(job, key, result):
+            teams = _replay_events(result)
+            if key is not None: # solved just now, not taken from the cache
+                cache.put(key, job[1], teams, winners.get(job[0]))
+            timed('write', job[0], write_tut_grp_rows, writer, teams, counter)
+
+        if workers <= 1:
+            for job in jobs:
+                key, teams = cached_teams(cache, job[1], job[2], options)
+                if teams is not None:
+                    write(job, None, (teams, None))
+                else:
+                    write(job, key, _solve_tut_grp_job(job))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                in_flight = deque() # (job, cache key, future or cached result), in file order
+                for job in jobs:
+                    key, teams = cached_teams(cache, job[1], job[2], options)
+                    if teams is not None:
+                        in_flight.append((job, None, (teams, None)))
+                    else:
+                        in_flight.append((job, key, executor.submit(_solve_tut_grp_job, job)))
+                    while len(in_flight) >= workers * 2 or (in_flight and not isinstance(in_flight[0][2], Future)):
+                        # write whatever is done at the front; wait for the oldest one once enough are in flight
+                        job, key, result = in_flight.popleft()
+                        write(job, key, result.result() if isinstance(result, Future) else result)
+                while in_flight:
+                    job, key, result = in_flight.popleft()
+                    write(job, key, result.result() if isinstance(result, Future) else result)
+
+    if cache is not None:
+        cache.evict()
+
+
+def main(argv=None):
+    # the command line entry point; argv defaults to sys.argv[1:], so main(["--seed", "3"]) works from the notebook too
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes, 1 runs serially")
+    parser.add_argument("--seed", default=None, help="base seed, each tut grp derives its own seed from it")
+    parser.add_argument("--optimizer", choices=OPTIMIZERS, default="swap",
+                        help="swap = pairwise swaps, anneal = simulated annealing, neighbourhood = swaps between promising teams only")
+    parser.add_argument("--time-budget", type=float, default=None, help="anneal only: seconds to spend per tut grp")
+    parser.add_argument("--max-evaluations", type=int, default=None, help="anneal only: neighbours to try per tut grp")
+    parser.add_argument("--input", default="records.csv", help="csv file (or snapshot.py snapshot) with the students, relative to this file")
+    parser.add_argument("--output", default="balanced_teams.csv", help="csv file to write the teams to, relative to this file")
+    parser.add_argument("--stream", action="store_true", help="read, solve and write 1 tut grp at a time (input must be grouped)")
+    parser.add_argument("--profile", action="store_true", help="save a timing / counter profile next to the output file")
+    parser.add_argument("--attempts", type=int, default=1, help="multi start: seeded attempts per tut grp, the best one is kept")
+    parser.add_argument("--target-imbalance", type=float, default=None, help="multi start: stop once a tut grp is at or below this")
+    parser.add_argument("--cache-dir", default=None, help="reuse results of unchanged tut grps from this directory (off if not given)")
+    parser.add_argument("--cache-max-mb", type=float, default=50, help="size limit of the cache directory")
+    parser.add_argument("--clear-cache", action="store_true", help="empty the cache first, so every tut grp is solved again")
+    parser.add_argument("--criteria", default=None, help="json file with balancing criteria (see criteria.py) instead of the built in rules")
+    args = parser.parse_args(argv)
+
+    cache = None
+    if args.cache_dir is not None:
+        from result_cache import ResultCache
+        cache = ResultCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024))
+        if args.clear_cache:
+            cache.clear()
+
+    added_hooks = [] # removed again at the end, so calling main() more than once does not pile up hooks
+    if args.profile:
+        from profiling import Profiler
+        profiler = Profiler()
+        added_hooks.append(profiler)
+
+    options = {'max_rounds': 100, 'optimizer': args.optimizer, 'time_budget': args.time_budget, 'max_evaluations': args.max_evaluations}
+    if args.criteria is not None:
+        options['criteria'] = load_criteria(args.criteria)
+    if args.attempts > 1:
+        options['attempts'] = args.attempts
+        options['target_imbalance'] = args.target_imbalance
+        winning_seeds = {} # tut grp -> the 'multi_start' event of its winning attempt
+        added_hooks.append(lambda event, data: winning_seeds.__setitem__(data['tut_group'], data) if event == 'multi_start' else None)
+
+    for hook in added_hooks:
+        add_hook(hook)
+    try:
+        if args.stream:
+            stream_tut_grps(args.input, args.output, workers=args.workers, seed=args.seed, cache=cache, **options)
+        else:
+            all_students = timed('read', None, read_student_records, args.input)
+            optimized_tut_grps = solve_tut_grps(all_students, workers=args.workers, seed=args.seed, cache=cache, **options)
+
+            write_student_records(optimized_tut_grps, args.output)
+    finally:
+        for hook in added_hooks:
+            remove_hook(hook)
+
+    if args.profile:
+        profiler.write(args.output)
+    if args.attempts > 1: # so that every tut grp can be reproduced with solve_tut_grp(students, seed=...)
+        output_path = Path(__file__).parent / args.output
+        with output_path.with_name(output_path.stem + "_seeds.json").open("w", encoding="utf-8") as file:
+            json.dump(winning_seeds, file, indent=2)
+    if cache is not None:
+        print(f"cache: {cache.hits} tut grps reused, {cache.misses} solved")
+
+
+if __name__ == "__main__": # guard needed so that worker processes can import this file without re-running everything
+    # numpy_swaps.py, annealing.py etc. import this file as "multipletutgrp"; point that name at this running module
+    # so they share the same hooks and settings instead of loading a second copy of it
+    sys.modules.setdefault("multipletutgrp", sys.modules[__name__])
+    main()
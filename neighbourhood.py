@@ -0,0 +1,136 @@
+# neighbourhood restricted swap optimizer, for tut grps with hundreds of teams
+#
+# optimize_teams tries every pair of teams and every pair of students, so 1 round costs O(n^2) in the number of
+# teams. most of those swaps are hopeless though: a team whose cgpa is too high can only be fixed by a team whose
+# cgpa is too low, and a team with too many of 1 school only by a team with few of that school. so every round:
+#   - the teams go into a priority queue (heapq) on their imbalance, worst first; a team that is already at its
+#     floor (the school / gender imbalance no team of its size can avoid, plus BOUND_TOLERANCE) is left alone
+#   - the worst team is popped and only compared with its candidate partners:
+#       * the `neighbours` teams whose cgpa error is closest to minus its own (bisect in a list sorted on error)
+#       * if it has a school / gender surplus (more than half the team, beyond what its size forces), the
+#         `neighbours` teams with the fewest of that school / gender
+#   - the best improving swap among those (imbalance_after_swap, same objective as optimize_teams) is applied, and
+#     both teams go back into the queue with their new imbalance; old queue entries are skipped when popped
+# the sorted partner lists are rebuilt once per round, so a round costs O(n log n) for the sorting plus
+# O(n * neighbours * team size^2) for the swaps, instead of O(n^2 * team size^2).
+# like the other optimizers it stops when a round does not improve anything or the lower bound is reached.
+
+from bisect import bisect_left
+import heapq
+
+import multipletutgrp
+from multipletutgrp import (BOUND_TOLERANCE, SWAP_EPSILON, apply_swap, emit, imbalance_after_swap, init_team_state,
+                            refresh_team_fields, report_bound, stop_imbalance)
+
+def team_floor(size, num_schools, num_genders):
+    # the school + gender imbalance a team of this size cannot avoid, see category_lower_bound
+    return max(0, -(-size // num_schools) - size // 2) + max(0, -(-size // num_genders) - size // 2)
+
+def surplus(freq, size, num_categories):
+    # the school / gender that has more members than the team can avoid (over half, and over its fair share), or None
+    key, count = max(freq.items(), key=lambda item: item[1])
+    return key if count > max(size // 2, -(-size // num_categories)) else None
+
+class PartnerIndex:
+    # the per round sorted lists that candidate partners are taken from
+    def __init__(self, states, tut_avg_cgpa, neighbours, num_categories):
+        self.states = states
+        self.tut_avg_cgpa = tut_avg_cgpa
+        self.neighbours = neighbours
+        self.num_categories = num_categories # {'school_freq': number of schools, 'gender_freq': number of genders}
+        errors = [state['cgpa_sum'] / state['size'] - tut_avg_cgpa for state in states]
+        self.by_error = sorted(range(len(states)), key=errors.__getitem__)
+        self.errors = [errors[num] for num in self.by_error] # ascending, for bisect
+        self.by_count = {} # ('school_freq', school) -> teams sorted by how many of that school they have, built when needed
+
+    def error(self, team_num):
+        state = self.states[team_num]
+        return state['cgpa_sum'] / state['size'] - self.tut_avg_cgpa
+
+    def opposite_error(self, team_num):
+        # the teams whose cgpa error is closest to minus this team's error: swapping a member with them can cancel out
+        # both errors at once. the errors are from the start of the round, a team that changed since is a bit off
+        error = self.error(team_num)
+        position = bisect_left(self.errors, -error)
+        window = self.by_error[max(0, position - self.neighbours // 2):position + self.neighbours // 2 + 1]
+        return [num for num in window if self.error(num) * error <= 0]
+
+    def fewest(self, freq_name, key):
+        if (freq_name, key) not in self.by_count:
+            self.by_count[(freq_name, key)] = sorted(range(len(self.states)), key=lambda num: self.states[num][freq_name].get(key, 0))
+        return self.by_count[(freq_name, key)][:self.neighbours + 1] # +1, the team itself may be in there
+
+    def partners(self, team_num):
+        state = self.states[team_num]
+        candidates = self.opposite_error(team_num)
+        for freq_name in ('school_freq', 'gender_freq'):
+            key = surplus(state[freq_name], state['size'], self.num_categories[freq_name])
+            if key is not None:
+                candidates.extend(self.fewest(freq_name, key))
+        return [num for num in dict.fromkeys(candidates) if num != team_num] # no duplicates, in order
+
+def best_swap(team1, state1, team2, state2, tut_avg_cgpa):
+    # (change, a, b, new imbalance 1, new imbalance 2) of the best swap between 2 teams, change is inf if none
+    best = (float("inf"), None, None, None, None)
+    for a, student1 in enumerate(team1):
+        for b, student2 in enumerate(team2):
+            new_imbalance1 = imbalance_after_swap(state1, student1, student2, tut_avg_cgpa)
+            new_imbalance2 = imbalance_after_swap(state2, student2, student1, tut_avg_cgpa)
+            change = new_imbalance1 + new_imbalance2 - state1['imbalance'] - state2['imbalance']
+            if change < best[0]:
+                best = (change, a, b, new_imbalance1, new_imbalance2)
+    return best
+
+def optimize_teams_neighbourhood(teams, tut_avg_cgpa, max_rounds=100, neighbours=8):
+    states = [init_team_state(team, tut_avg_cgpa) for team in teams]
+    students = [student for team in teams for student in team]
+    num_schools = len({student.school for student in students})
+    num_genders = len({student.gender for student in students})
+    floors = [team_floor(len(team), num_schools, num_genders) + BOUND_TOLERANCE for team in teams]
+    lower_bound, stop_at = stop_imbalance(teams, tut_avg_cgpa)
+    total = sum(state['imbalance'] for state in states)
+
+    for round_num in range(max_rounds):
+        if total <= stop_at:
+            break
+        index = PartnerIndex(states, tut_avg_cgpa, neighbours, {'school_freq': num_schools, 'gender_freq': num_genders})
+        queue = [(-state['imbalance'], num) for num, state in enumerate(states) if state['imbalance'] > floors[num]]
+        heapq.heapify(queue)
+        evaluated = accepted = pops = 0
+
+        while queue and pops < len(teams) and total > stop_at: # about 1 look at every team per round
+            negative_imbalance, i = heapq.heappop(queue)
+            if -negative_imbalance != states[i]['imbalance']:
+                continue # stale entry, the team changed since it was pushed
+            pops += 1
+
+            best = (-SWAP_EPSILON, None, None, None, None, None)
+            for j in index.partners(i):
+                change, a, b, new_imbalance1, new_imbalance2 = best_swap(teams[i], states[i], teams[j], states[j], tut_avg_cgpa)
+                evaluated += len(teams[i]) * len(teams[j])
+                if change < best[0]:
+                    best = (change, j, a, b, new_imbalance1, new_imbalance2)
+            change, j, a, b, new_imbalance1, new_imbalance2 = best
+            if j is None:
+                continue # no partner helps, the team drops out of the queue for this round
+
+            student1, student2 = teams[i][a], teams[j][b]
+            teams[i][a], teams[j][b] = student2, student1
+            apply_swap(states[i], student1, student2, new_imbalance1)
+            apply_swap(states[j], student2, student1, new_imbalance2)
+            total += change
+            accepted += 1
+            for num in (i, j):
+                if states[num]['imbalance'] > floors[num]:
+                    heapq.heappush(queue, (-states[num]['imbalance'], num))
+
+        if multipletutgrp.hooks:
+            emit('round', {'tut_group': teams[0][0].tutorial_group, 'round': round_num + 1, 'evaluated': evaluated, 'accepted': accepted})
+
+        # Stop if no further improvements
+        if accepted == 0:
+            break
+
+    refresh_team_fields(teams)
+    report_bound(teams, tut_avg_cgpa, lower_bound)
+    return teams
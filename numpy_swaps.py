@@ -0,0 +1,116 @@
+# numpy backend for optimize_teams, used automatically for big tut grps when numpy is installed
+#
+# the whole tut grp is stored as integer arrays instead of lists of Student records:
+#   team_of[k]      -> which team student k is in
+#   cgpa[k]         -> cgpa of student k
+#   school[k]       -> school of student k as a number (category code)
+#   gender[k]       -> gender of student k as a number (category code)
+# plus per team: size, cgpa sum and a count matrix for schools and genders.
+#
+# for 1 team we then work out the imbalance change of swapping any of its members with any student of
+# any other team in 1 go (numpy broadcasting instead of 4 nested loops), and apply the best swap if it helps.
+# the objective is the same as calculate_team_imbalance, so the results can be compared with the python version.
+
+import numpy as np
+
+import multipletutgrp
+from multipletutgrp import SWAP_EPSILON, emit, refresh_team_fields, report_bound, stop_imbalance
+
+def encode_teams(teams):
+    students = [student for team in teams for student in team]
+    team_of = np.array([team_num for team_num, team in enumerate(teams) for _ in team], dtype=np.int64)
+    cgpa = np.array([student.cgpa for student in students], dtype=np.float64)
+
+    school_codes = {} # school name -> code, in order of first appearance
+    gender_codes = {}
+    school = np.array([school_codes.setdefault(student.school, len(school_codes)) for student in students], dtype=np.int64)
+    gender = np.array([gender_codes.setdefault(student.gender, len(gender_codes)) for student in students], dtype=np.int64)
+
+    return students, team_of, cgpa, school, gender, len(school_codes), len(gender_codes)
+
+def team_imbalance(cgpa_sum, size, max_school_count, max_gender_count, tut_avg_cgpa):
+    # calculate_team_imbalance written for arrays: works on 1 team or on a whole grid of proposed swaps
+    half_size = size // 2
+    cgpa_imbalance = np.abs(cgpa_sum / size - tut_avg_cgpa)
+    school_imbalance = np.maximum(max_school_count - half_size, 0)
+    gender_imbalance = np.maximum(max_gender_count - half_size, 0)
+    return cgpa_imbalance + school_imbalance + gender_imbalance
+
+def optimize_teams_numpy(teams, tut_avg_cgpa, max_rounds):
+    students, team_of, cgpa, school, gender, num_schools, num_genders = encode_teams(teams)
+    num_teams = len(teams)
+
+    size = np.bincount(team_of, minlength=num_teams)
+    cgpa_sum = np.bincount(team_of, weights=cgpa, minlength=num_teams)
+    school_onehot = np.eye(num_schools, dtype=np.int64)[school] # row k has a 1 in the column of student k's school
+    gender_onehot = np.eye(num_genders, dtype=np.int64)[gender]
+    school_counts = np.zeros((num_teams, num_schools), dtype=np.int64)
+    gender_counts = np.zeros((num_teams, num_genders), dtype=np.int64)
+    np.add.at(school_counts, (team_of, school), 1)
+    np.add.at(gender_counts, (team_of, gender), 1)
+    imbalance = team_imbalance(cgpa_sum, size, school_counts.max(axis=1), gender_counts.max(axis=1), tut_avg_cgpa)
+    lower_bound, stop_at = stop_imbalance(teams, tut_avg_cgpa)
+    total = float(imbalance.sum())
+
+    for round_num in range(max_rounds):
+        if total <= stop_at: # as good as it gets, no point looking further
+            break
+        improved = False
+        evaluated = accepted = 0
+
+        for i in range(num_teams):
+            if total <= stop_at:
+                break
+            members = np.flatnonzero(team_of == i) # students in team i, rows of the grid
+            others = np.flatnonzero(team_of != i) # everyone else, columns of the grid
+            other_teams = team_of[others]
+
+            # cgpa change of team i for every (member, other) swap; the other team changes by the opposite amount
+            cgpa_change = cgpa[others][None, :] - cgpa[members][:, None]
+
+            # school / gender counts after each swap, shape (members, others, categories), then the max per swap
+            school_after_i = school_counts[i] - school_onehot[members][:, None, :] + school_onehot[others][None, :, :]
+            gender_after_i = gender_counts[i] - gender_onehot[members][:, None, :] + gender_onehot[others][None, :, :]
+            school_after_j = school_counts[other_teams][None, :, :] - school_onehot[others][None, :, :] + school_onehot[members][:, None, :]
+            gender_after_j = gender_counts[other_teams][None, :, :] - gender_onehot[others][None, :, :] + gender_onehot[members][:, None, :]
+
+            new_imbalance_i = team_imbalance(cgpa_sum[i] + cgpa_change, size[i],
+                                             school_after_i.max(axis=2), gender_after_i.max(axis=2), tut_avg_cgpa)
+            new_imbalance_j = team_imbalance(cgpa_sum[other_teams] - cgpa_change, size[other_teams],
+                                             school_after_j.max(axis=2), gender_after_j.max(axis=2), tut_avg_cgpa)
+            change = new_imbalance_i + new_imbalance_j - imbalance[i] - imbalance[other_teams]
+
+            evaluated += change.size
+            best = int(np.argmin(change))
+            a, b = divmod(best, len(others))
+            if change[a, b] >= -SWAP_EPSILON: # best swap does not help, leave team i alone
+                continue
+
+            # apply the best swap to the arrays
+            student1, student2, j = members[a], others[b], other_teams[b]
+            team_of[student1], team_of[student2] = j, i
+            cgpa_sum[i] += cgpa_change[a, b]
+            cgpa_sum[j] -= cgpa_change[a, b]
+            school_counts[i] += school_onehot[student2] - school_onehot[student1]
+            school_counts[j] += school_onehot[student1] - school_onehot[student2]
+            gender_counts[i] += gender_onehot[student2] - gender_onehot[student1]
+            gender_counts[j] += gender_onehot[student1] - gender_onehot[student2]
+            imbalance[i] = new_imbalance_i[a, b]
+            imbalance[j] = new_imbalance_j[a, b]
+            total += float(change[a, b])
+            improved = True
+            accepted += 1
+
+        if multipletutgrp.hooks:
+            emit('round', {'tut_group': students[0].tutorial_group, 'round': round_num + 1, 'evaluated': evaluated, 'accepted': accepted})
+
+        # Stop if no further improvements
+        if not improved:
+            break
+
+    # write the arrays back into the team lists, in place so callers holding the lists see the result
+    for team_num, team in enumerate(teams):
+        team[:] = [students[k] for k in np.flatnonzero(team_of == team_num)]
+    refresh_team_fields(teams)
+    report_bound(teams, tut_avg_cgpa, lower_bound)
+    return teams
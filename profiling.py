@@ -0,0 +1,113 @@
+# profile report for a run of multipletutgrp.py
+#
+# Profiler is a hook (see add_hook in multipletutgrp.py) that collects the events of a run per tut grp:
+#   - read / form / optimise / write time
+#   - number of team slots filled, eligibility checks (the (school, gender) buckets looked at, which replaced the
+#     can_add_student calls), the candidate pool size of every slot and how often the fallback had to be used
+#   - swaps evaluated and accepted in every round of the swap optimization
+#   - the lower bound of the total imbalance and the gap between it and the final teams
+#   - the winning seed of a multi start search. the slot / round counts add up all of its attempts (see the
+#     attempts column); the imbalance and gap are those of the winning attempt's teams, the ones that are kept
+# write() saves it as <output>_profile.json (everything, incl. per slot pool sizes and per round counts) and
+# <output>_profile.csv (1 summary row per tut grp), next to the output csv.
+#
+# usage: python multipletutgrp.py --profile
+#    or: profiler = Profiler(); add_hook(profiler); ...run...; remove_hook(profiler); profiler.write("balanced_teams.csv")
+
+from pathlib import Path
+import csv
+import json
+
+PHASES = ["read", "form", "optimise", "write"]
+
+CSV_COLUMNS = ["tut_group"] + [f"{phase}_seconds" for phase in PHASES] + [
+    "attempts", "slots", "eligibility_checks", "mean_pool_size", "max_pool_size", "fallbacks",
+    "rounds", "swaps_evaluated", "swaps_accepted", "lower_bound", "imbalance", "gap"]
+
+class Profiler:
+    def __init__(self):
+        self.tut_grps = {} # tut grp -> its counters, None is used for things that are not about 1 tut grp
+
+    def tut_grp(self, tut_group):
+        if tut_group not in self.tut_grps:
+            self.tut_grps[tut_group] = {
+                **{f"{phase}_seconds": 0.0 for phase in PHASES},
+                'slots': 0,
+                'eligibility_checks': 0,
+                'fallbacks': 0,
+                'pool_sizes': [],
+                'rounds': []
+            }
+        return self.tut_grps[tut_group]
+
+    def __call__(self, event, data):
+        counters = self.tut_grp(data['tut_group'])
+        if event == 'phase':
+            counters[f"{data['phase']}_seconds"] += data['seconds']
+        elif event == 'slot':
+            counters['slots'] += 1
+            counters['eligibility_checks'] += data['eligibility_checks']
+            counters['pool_sizes'].append(data['pool_size'])
+            if data['fallback']:
+                counters['fallbacks'] += 1
+        elif event == 'round':
+            counters['rounds'].append({'round': data['round'], 'evaluated': data['evaluated'], 'accepted': data['accepted']})
+        elif event == 'bound':
+            counters['lower_bound'] = data['lower_bound'] # the same for every attempt of a multi start
+            if 'multi_start' not in counters:
+                counters['imbalance'] = data['imbalance']
+        elif event == 'multi_start':
+            # every attempt sent its own 'bound' event, the teams that are kept are the winning attempt's
+            counters['multi_start'] = {key: value for key, value in data.items() if key != 'tut_group'}
+            counters['imbalance'] = data['imbalance']
+
+    def summary_row(self, tut_group, counters):
+        pool_sizes = counters['pool_sizes']
+        return {
+            'tut_group': tut_group if tut_group is not None else "(all)",
+            **{f"{phase}_seconds": round(counters[f"{phase}_seconds"], 6) for phase in PHASES},
+            'attempts': counters['multi_start']['attempts_run'] if 'multi_start' in counters else int(tut_group is not None),
+            'slots': counters['slots'],
+            'eligibility_checks': counters['eligibility_checks'],
+            'mean_pool_size': round(sum(pool_sizes) / len(pool_sizes), 3) if pool_sizes else 0,
+            'max_pool_size': max(pool_sizes) if pool_sizes else 0,
+            'fallbacks': counters['fallbacks'],
+            'rounds': len(counters['rounds']),
+            'swaps_evaluated': sum(entry['evaluated'] for entry in counters['rounds']),
+            'swaps_accepted': sum(entry['accepted'] for entry in counters['rounds']),
+            'lower_bound': round(counters.get('lower_bound', 0.0), 6),
+            'imbalance': round(counters.get('imbalance', 0.0), 6),
+            'gap': round(counters.get('imbalance', 0.0) - counters.get('lower_bound', 0.0), 6)
+        }
+
+    def totals(self):
+        rows = [self.summary_row(tut_group, counters) for tut_group, counters in self.tut_grps.items()]
+        totals = {column: sum(row[column] for row in rows) for column in CSV_COLUMNS if column not in ("tut_group", "mean_pool_size", "max_pool_size")}
+        all_pool_sizes = [size for counters in self.tut_grps.values() for size in counters['pool_sizes']]
+        totals['mean_pool_size'] = round(sum(all_pool_sizes) / len(all_pool_sizes), 3) if all_pool_sizes else 0
+        totals['max_pool_size'] = max(all_pool_sizes) if all_pool_sizes else 0
+        return totals
+
+    def write(self, output_filename):
+        output_path = Path(__file__).parent / output_filename
+        json_path = output_path.with_name(output_path.stem + "_profile.json")
+        csv_path = output_path.with_name(output_path.stem + "_profile.csv")
+
+        report = {
+            'totals': self.totals(),
+            'tut_groups': {str(tut_group): {**self.summary_row(tut_group, counters),
+                                            'pool_sizes': counters['pool_sizes'],
+                                            'round_counts': counters['rounds'],
+                                            **({'multi_start': counters['multi_start']} if 'multi_start' in counters else {})}
+                           for tut_group, counters in self.tut_grps.items()}
+        }
+        with json_path.open("w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+        with csv_path.open("w", encoding="utf-8", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=CSV_COLUMNS, lineterminator="\n")
+            writer.writeheader()
+            for tut_group, counters in self.tut_grps.items():
+                writer.writerow(self.summary_row(tut_group, counters))
+
+        return json_path, csv_path
@@ -0,0 +1,221 @@
+# warm start re-balancing for add / drop week
+#
+# instead of re-running everything from a random shuffle, this starts from the previous balanced_teams.csv and
+# only applies the enrolment changes:
+#   1. load the previous assignment (tut grp -> team number -> students); the "Team n" column is the team, which
+#      needs a file written since the output counts actual teams (older files numbered every 5 rows)
+#   2. apply the delta file, all removes first and then all adds:
+#        remove -> the student leaves their team
+#        add    -> the student joins the smallest team of their tut grp (if equal, the one it unbalances least)
+#        move   -> a remove from the old tut grp and an add to the new one
+#      a brand new tut grp is formed from scratch with form_teams
+#   3. keep the number of teams per tut grp at len(students) // 5 like form_teams does: the smallest teams are
+#      dissolved into the others, or a new team is opened with 1 student taken from each of the biggest teams
+#   4. repair: every changed team plus its `neighbours` worst balanced teams of the same tut grp go through
+#      optimize_teams; all other teams are not touched at all
+# team numbers are kept, so everyone who is not in a repaired team stays exactly where they were.
+#
+# delta file columns: Action,Tutorial Group,Student ID,School,Name,Gender,CGPA
+#   (Action is add / remove / move; remove only needs the Student ID, move only the Student ID and the new
+#    Tutorial Group - the rest of the record is taken from the previous assignment)
+#
+# usage: python rebalance.py --previous balanced_teams.csv --delta changes.csv --output balanced_teams.csv
+
+from pathlib import Path
+import argparse
+import csv
+import random
+
+from multipletutgrp import (TEAM_SIZE, Student, calc_avg_cgpa, calculate_team_imbalance, form_teams, open_output,
+                            optimize_teams, output_row, parse_student_row)
+
+def read_previous_assignment(filename):
+    # tut grp -> {team number -> students}, both in file order
+    file_path = Path(__file__).parent / filename
+    tut_grps = {}
+    with file_path.open("r", encoding="utf-8", newline="") as file:
+        reader = csv.reader(file)
+        next(reader) # skip the header
+        for row in reader:
+            if not row:
+                continue
+            student = parse_student_row(row)
+            student.team_cgpa = float(row[6])
+            student.team_num = int(row[7].split()[-1]) # "Team 12" -> 12
+            teams = tut_grps.setdefault(student.tutorial_group, {})
+            teams.setdefault(student.team_num, []).append(student)
+    return tut_grps
+
+def read_delta(filename):
+    file_path = Path(__file__).parent / filename
+    removes = [] # student ids
+    adds = [] # Student records
+    moves = [] # (student id, new tut grp)
+    with file_path.open("r", encoding="utf-8", newline="") as file:
+        reader = csv.reader(file)
+        next(reader) # skip the header
+        for row in reader:
+            if not row:
+                continue
+            action = row[0].strip().lower()
+            if action not in ("add", "remove", "move"):
+                raise ValueError(f"unknown action {row[0]!r} in {filename}, expected add, remove or move")
+            if action == "remove":
+                removes.append(row[2])
+            elif action == "move":
+                moves.append((row[2], row[1]))
+            else:
+                adds.append(parse_student_row(row[1:]))
+    return removes, adds, moves
+
+def add_to_smallest_team(teams, student, tut_avg_cgpa):
+    smallest = min(len(team) for team in teams.values())
+    best_team_num = None
+    best_imbalance = None
+    for team_num, team in teams.items():
+        if len(team) != smallest:
+            continue
+        imbalance = calculate_team_imbalance(team + [student], tut_avg_cgpa)
+        if best_imbalance is None or imbalance < best_imbalance:
+            best_team_num, best_imbalance = team_num, imbalance
+    teams[best_team_num].append(student)
+    return best_team_num
+
+def fix_team_count(teams, affected, next_team_num, team_size=TEAM_SIZE):
+    # dissolves / opens teams until there are len(students) // team_size of them, returns the next free team number
+    for team_num in [team_num for team_num, team in teams.items() if not team]:
+        del teams[team_num] # empty teams are simply dropped
+        affected.discard(team_num)
+
+    num_of_students = sum(len(team) for team in teams.values())
+    target = max(1, num_of_students // team_size)
+
+    while len(teams) > target:
+        team_num = min(teams, key=lambda num: len(teams[num]))
+        members = teams.pop(team_num)
+        affected.discard(team_num)
+        for student in members: # hand the members out to the smallest of the remaining teams
+            receiver = min(teams, key=lambda num: len(teams[num]))
+            teams[receiver].append(student)
+            affected.add(receiver)
+
+    while len(teams) < target:
+        new_team = []
+        while len(new_team) < team_size:
+            donor = max(teams, key=lambda num: len(teams[num]))
+            if len(teams[donor]) <= team_size:
+                break
+            new_team.append(teams[donor].pop())
+            affected.add(donor)
+        teams[next_team_num] = new_team
+        affected.add(next_team_num)
+        next_team_num += 1
+
+    return next_team_num
+
+def repair_tut_grp(teams, affected, neighbours, max_rounds):
+    students = [student for team in teams.values() for student in team]
+    tut_avg_cgpa = calc_avg_cgpa(students)
+
+    # the worst balanced unchanged teams are the most useful partners for swapping with the changed ones
+    others = [team_num for team_num in teams if team_num not in affected]
+    others.sort(key=lambda num: calculate_team_imbalance(teams[num], tut_avg_cgpa), reverse=True)
+    scope = [team_num for team_num in teams if team_num in affected] + others[:neighbours * len(affected)]
+    if not scope:
+        return scope # the only change was a whole team leaving, the teams that are left did not change
+
+    optimize_teams([teams[team_num] for team_num in scope], tut_avg_cgpa, max_rounds)
+    return scope
+
+def rebalance(previous_filename, delta_filename, output_filename="balanced_teams.csv", neighbours=2, max_rounds=100, seed=None):
+    tut_grps = read_previous_assignment(previous_filename)
+    removes, adds, moves = read_delta(delta_filename)
+    rng = random.Random(seed)
+
+    where = {} # student id -> (tut grp, team number) before the changes
+    previous = {} # student id -> Student record before the changes
+    for tut_grp, teams in tut_grps.items():
+        for team_num, team in teams.items():
+            for student in team:
+                where[student.student_id] = (tut_grp, team_num)
+                previous[student.student_id] = student
+    for student_id, new_tut_grp in moves: # a move is a remove plus an add of the same record in the new tut grp
+        if student_id not in previous:
+            raise ValueError(f"cannot move student {student_id}, they are not in {previous_filename}")
+        student = previous[student_id]
+        removes.append(student_id)
+        adds.append(Student(new_tut_grp, student.student_id, student.school, student.name, student.gender, student.cgpa))
+    next_team_num = max((team_num for teams in tut_grps.values() for team_num in teams), default=0) + 1
+
+    affected = {} # tut grp -> set of changed team numbers
+    for student_id in removes:
+        if student_id not in where:
+            raise ValueError(f"cannot remove student {student_id}, they are not in {previous_filename}")
+        tut_grp, team_num = where[student_id]
+        team = tut_grps[tut_grp][team_num]
+        team[:] = [student for student in team if student.student_id != student_id]
+        affected.setdefault(tut_grp, set()).add(team_num)
+
+    removed_ids = set(removes)
+    new_tut_grps = {} # tut grp that did not exist before -> its students
+    for student in adds:
+        if student.student_id in where and student.student_id not in removed_ids:
+            raise ValueError(f"cannot add student {student.student_id}, they are already in {previous_filename}")
+        teams = tut_grps.get(student.tutorial_group)
+        if not teams:
+            new_tut_grps.setdefault(student.tutorial_group, []).append(student)
+            continue
+        current = [member for team in teams.values() for member in team] + [student]
+        team_num = add_to_smallest_team(teams, student, calc_avg_cgpa(current))
+        affected.setdefault(student.tutorial_group, set()).add(team_num)
+
+    repaired_students = 0
+    for tut_grp, changed in affected.items():
+        teams = tut_grps[tut_grp]
+        next_team_num = fix_team_count(teams, changed, next_team_num)
+        if not teams:
+            del tut_grps[tut_grp] # everyone in the tut grp was removed
+            continue
+        scope = repair_tut_grp(teams, changed, neighbours, max_rounds)
+        repaired_students += sum(len(teams[team_num]) for team_num in scope)
+
+    for tut_grp, students in new_tut_grps.items():
+        formed = optimize_teams(form_teams(students, rng), calc_avg_cgpa(students), max_rounds)
+        tut_grps[tut_grp] = {}
+        for team in formed:
+            tut_grps[tut_grp][next_team_num] = team
+            next_team_num += 1
+
+    # team numbers are the dict keys, optimize_teams renumbered them inside the repaired scope only
+    kept = 0
+    file, writer = open_output(output_filename)
+    with file:
+        for tut_grp, teams in tut_grps.items():
+            for team_num, team in sorted(teams.items()):
+                team_cgpa = calc_avg_cgpa(team)
+                for student in team:
+                    student.team_num = team_num
+                    student.team_cgpa = team_cgpa
+                    if where.get(student.student_id) == (tut_grp, team_num):
+                        kept += 1
+                    writer.writerow(output_row(student))
+
+    return {'removed': len(removes) - len(moves), 'added': len(adds) - len(moves), 'moved': len(moves),
+            'repaired_students': repaired_students, 'kept_in_team': kept,
+            'students': sum(len(team) for teams in tut_grps.values() for team in teams.values())}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--previous", default="balanced_teams.csv", help="previous output of multipletutgrp.py")
+    parser.add_argument("--delta", required=True, help="csv file with the add / remove / move changes")
+    parser.add_argument("--output", default="balanced_teams.csv", help="csv file to write the repaired teams to")
+    parser.add_argument("--neighbours", type=int, default=2, help="extra teams per changed team that the repair may swap with")
+    parser.add_argument("--max-rounds", type=int, default=100, help="max_rounds for the repair")
+    parser.add_argument("--seed", default=None, help="seed for forming brand new tut grps")
+    args = parser.parse_args()
+
+    stats = rebalance(args.previous, args.delta, args.output, args.neighbours, args.max_rounds, args.seed)
+    print(f"{stats['kept_in_team']} of {stats['students']} students kept their team "
+          f"({stats['removed']} removed, {stats['added']} added, {stats['moved']} moved, "
+          f"{stats['repaired_students']} in repaired teams)")
@@ -0,0 +1,95 @@
+# on disk result cache for solved tut grps
+#
+# most reruns only change a few tut grps, so a solved tut grp is saved under a key that is the sha256 of
+#   - its student rows (tut grp, id, school, name, gender, cgpa and any extra columns, in file order)
+#   - the seed of the tut grp
+#   - the algorithm settings: the solve options (max_rounds, optimizer, criteria, ...), TEAM_SIZE and CGPA_TOLERANCE
+#   - CACHE_VERSION, to be bumped whenever the algorithms change what they produce
+# if nothing of that changed, the stored teams are reused and the tut grp is not solved again.
+# the stored value is just which input row went into which team, so it is small and does not depend on pickling,
+# plus the 'multi_start' event of a multi start search, so a reused result still reports its winning seed.
+#
+# 1 json file per tut grp in the cache directory. when the directory grows past max_bytes, the least recently
+# used files are deleted (a cache hit touches the file). clear() / --clear-cache throws everything away.
+# note that a run without a seed also gets cached under seed None, so it reuses the last unseeded result.
+
+from pathlib import Path
+import hashlib
+import json
+import os
+
+from multipletutgrp import CGPA_TOLERANCE, TEAM_SIZE, refresh_team_fields
+
+CACHE_VERSION = 2
+
+def row_fields(student):
+    fields = [student.tutorial_group, student.student_id, student.school, student.name, student.gender, student.cgpa]
+    if student.extra: # extra csv columns can matter to the criteria, files without them keep their old keys
+        fields.append(tuple(sorted(student.extra.items())))
+    return fields
+
+class ResultCache:
+    def __init__(self, directory=".team_cache", max_bytes=50 * 1024 * 1024):
+        self.directory = Path(__file__).parent / directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, students, seed, options):
+        content = {
+            'version': CACHE_VERSION,
+            'rows': [row_fields(student) for student in students],
+            'seed': seed,
+            'options': options,
+            'team_size': TEAM_SIZE,
+            'cgpa_tolerance': CGPA_TOLERANCE
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return self.directory / f"{key}.json"
+
+    def get(self, key, students):
+        # (teams, multi_start event or None) if students are cached, the teams built from the given Student records;
+        # otherwise None
+        path = self.path(key)
+        try:
+            with path.open("r", encoding="utf-8") as file:
+                entry = json.load(file)
+            positions = entry['teams']
+        except (OSError, ValueError, KeyError): # missing or damaged file counts as a miss
+            self.misses += 1
+            return None
+        os.utime(path) # mark as recently used for the eviction
+        self.hits += 1
+        teams = [[students[position] for position in team] for team in positions]
+        refresh_team_fields(teams)
+        return teams, entry.get('multi_start')
+
+    def put(self, key, students, teams, multi_start=None):
+        # teams may hold copies of the students (eg. coming back from a worker process), so rows are matched by content
+        positions_by_row = {}
+        for position, student in enumerate(students):
+            positions_by_row.setdefault(tuple(row_fields(student)), []).append(position)
+        positions = [[positions_by_row[tuple(row_fields(student))].pop() for student in team] for team in teams]
+
+        temp_path = self.path(key).with_suffix(".tmp")
+        with temp_path.open("w", encoding="utf-8") as file:
+            json.dump({'teams': positions, 'multi_start': multi_start}, file)
+        os.replace(temp_path, self.path(key)) # so a reader never sees half a file
+
+    def evict(self):
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(self.directory)
+                   if entry.name.endswith(".json")]
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries): # oldest first
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json") or entry.name.endswith(".tmp"):
+                os.remove(entry.path)
@@ -0,0 +1,261 @@
+# long running solver service
+#
+# starting python, importing numpy and forking workers costs more than solving 1 tut grp, so instead of running
+# multipletutgrp.py for every request this keeps a process pool warm and answers "balance this tut grp" requests.
+# 1 json object per line in, 1 json object per line out:
+#   request:  {"id": 1, "students": [["G-1", "5002", "CCDS", "Aarav Singh", "Male", 4.02], ...],
+#              "seed": "abc", "options": {"max_rounds": 100, "optimizer": "swap", ...}}
+#             students are csv rows without the header, all from the same tut grp; seed and options are optional,
+#             options are the ones solve_tut_grp takes (see OPTION_NAMES)
+#   response: {"id": 1, "teams": [[{"tutorial_group": .., "team_cgpa": .., "team_assigned": "Team 1", ...}, ...], ...],
+#              "imbalance": 9.8, "seconds": 0.012}
+#             imbalance is the total imbalance under the request's criteria option, the built in rules without one
+#          or {"id": 1, "error": "..."}
+#   {"op": "ping"} -> {"ok": true}, {"op": "stats"} -> request counters, {"op": "shutdown"} stops the service
+# the same request with the same seed gives the same teams as solve_tut_grp(students, seed, **options).
+#
+# transports:
+#   stdin / stdout (default): responses are written as soon as they are done, so they can come back out of
+#     order when requests overlap - match them up by id
+#   --socket PATH (unix socket) or --port N (tcp on 127.0.0.1): connections are served concurrently and every
+#     connection gets its responses in the order of its requests
+#
+# usage: python service.py --workers 4
+#        python service.py --socket /tmp/teams.sock --cache-dir .team_cache
+
+from concurrent.futures import Future, ProcessPoolExecutor
+import argparse
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+
+from criteria import check_criteria, compile_criteria
+from multipletutgrp import (OPTIMIZERS, _solve_tut_grp_job, cached_teams, calc_avg_cgpa, parse_student_row, refresh_team_fields,
+                            total_imbalance)
+
+OPTION_NAMES = ("max_rounds", "optimizer", "time_budget", "max_evaluations", "attempts", "target_imbalance", "criteria")
+
+def _warm_up(_): # module level so that the process pool can pickle it
+    # import the optional backends in the worker now, instead of during the first request that needs them
+    import annealing
+    import neighbourhood
+    try:
+        import numpy_swaps
+    except ImportError:
+        pass
+    return os.getpid()
+
+def parse_request(request):
+    # (students, seed, options) of a balance request, ValueError if it is malformed
+    rows = request.get('students')
+    if not isinstance(rows, list) or not rows:
+        raise ValueError("students must be a non-empty list of rows")
+    students = [parse_student_row([str(value) for value in row]) for row in rows]
+    if len({student.tutorial_group for student in students}) > 1:
+        raise ValueError("all students of a request must be from the same tut grp")
+    options = request.get('options') or {}
+    unknown = sorted(set(options) - set(OPTION_NAMES))
+    if unknown:
+        raise ValueError(f"unknown options {unknown}, expected some of {list(OPTION_NAMES)}")
+    if options.get('optimizer', "swap") not in OPTIMIZERS:
+        raise ValueError(f"unknown optimizer {options['optimizer']!r}, expected one of {OPTIMIZERS}")
+    if options.get('criteria') is not None: # checked here, so a bad criterion is an error response and never compiled
+        check_criteria(options['criteria'], students)
+    return students, request.get('seed'), options
+
+class SolverService:
+    def __init__(self, workers=1, cache=None):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        list(self.executor.map(_warm_up, range(workers))) # start the workers now, not on the first request
+        self.cache = cache # a ResultCache, or None
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'solved': 0, 'cached': 0, 'errors': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def respond(self, request_id, students, options, teams, start):
+        refresh_team_fields(teams) # team numbers 1..n within the tut grp
+        if options.get('criteria') is not None: # the imbalance the request asked to minimise, not the built in one
+            rules = compile_criteria(options['criteria'])
+            rules.prepare(students)
+            imbalance = rules.total_imbalance(teams, *rules.group_means(students))
+        else:
+            imbalance = total_imbalance(teams, calc_avg_cgpa(students))
+        return {
+            'id': request_id,
+            'teams': [[student.as_dict() for student in team] for team in teams],
+            'imbalance': imbalance,
+            'seconds': time.perf_counter() - start
+        }
+
+    def submit(self, request):
+        # a Future of the response dict; errors are answered with an 'error' response, they never stop the service
+        start = time.perf_counter()
+        done = Future()
+        request_id = request.get('id') if isinstance(request, dict) else None
+        self.count('requests')
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("a request must be a json object")
+            op = request.get('op', "balance")
+            if op == "ping":
+                done.set_result({'id': request_id, 'ok': True})
+                return done
+            if op == "stats":
+                with self.lock:
+                    done.set_result({'id': request_id, 'workers': self.workers, **self.counters})
+                return done
+            if op != "balance":
+                raise ValueError(f"unknown op {op!r}, expected balance, ping, stats or shutdown")
+            students, seed, options = parse_request(request)
+        except (ValueError, TypeError, IndexError) as error:
+            self.count('errors')
+            done.set_result({'id': request_id, 'error': str(error)})
+            return done
+
+        key, teams = cached_teams(self.cache, students, seed, options)
+        if teams is not None:
+            self.count('cached')
+            done.set_result(self.respond(request_id, students, options, teams, start))
+            return done
+
+        def finished(future):
+            try:
+                teams = future.result()[0]
+            except Exception as error: # a failing tut grp must not take the service down with it
+                self.count('errors')
+                done.set_result({'id': request_id, 'error': f"{type(error).__name__}: {error}"})
+                return
+            if key is not None:
+                self.cache.put(key, students, teams)
+            self.count('solved')
+            done.set_result(self.respond(request_id, students, options, teams, start))
+
+        job = (students[0].tutorial_group, students, seed, options, False)
+        self.executor.submit(_solve_tut_grp_job, job).add_done_callback(finished)
+        return done
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        if self.cache is not None:
+            self.cache.evict()
+
+def decode(line):
+    # (request, error response): exactly 1 of them is None
+    try:
+        return json.loads(line), None
+    except ValueError as error:
+        return None, {'id': None, 'error': f"invalid json: {error}"}
+
+def is_shutdown(request):
+    return isinstance(request, dict) and request.get('op') == "shutdown"
+
+def serve_stdio(service, input_stream=sys.stdin, output_stream=sys.stdout):
+    write_lock = threading.Lock() # callbacks of different requests finish on different threads
+
+    def reply(response):
+        with write_lock:
+            output_stream.write(json.dumps(response) + "\n")
+            output_stream.flush()
+
+    pending = []
+    for line in input_stream:
+        if not line.strip():
+            continue
+        request, error = decode(line)
+        if error is not None:
+            reply(error)
+            continue
+        if is_shutdown(request):
+            break
+        replied = Future() # done once the response is written, not just computed
+
+        def write_response(future, replied=replied):
+            reply(future.result())
+            replied.set_result(None)
+
+        service.submit(request).add_done_callback(write_response)
+        pending = [future for future in pending if not future.done()] + [replied]
+    for replied in pending: # answer everything that was asked before the shutdown / end of input
+        replied.result()
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def reply(self, response):
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def handle(self):
+        for raw_line in self.rfile:
+            line = raw_line.decode("utf-8")
+            if not line.strip():
+                continue
+            request, error = decode(line)
+            if error is not None:
+                self.reply(error)
+                continue
+            if is_shutdown(request):
+                self.reply({'id': request.get('id'), 'ok': True})
+                threading.Thread(target=self.server.shutdown).start() # shutdown() waits for serve_forever, so not on this thread
+                return
+            self.reply(self.server.service.submit(request).result())
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def serve_socket(service, socket_path=None, port=None):
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path) # left over from a service that did not shut down cleanly
+        server = ThreadingUnixServer(socket_path, RequestHandler)
+    else:
+        server = ThreadingTCPServer(("127.0.0.1", port), RequestHandler) # local only, there is no authentication
+    server.service = service
+    try:
+        with server:
+            server.serve_forever()
+    finally:
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of warm worker processes")
+    parser.add_argument("--socket", default=None, help="listen on this unix socket instead of stdin / stdout")
+    parser.add_argument("--port", type=int, default=None, help="listen on this tcp port on 127.0.0.1 instead of stdin / stdout")
+    parser.add_argument("--cache-dir", default=None, help="reuse results of repeated requests from this directory (off if not given)")
+    parser.add_argument("--cache-max-mb", type=float, default=50, help="size limit of the cache directory")
+    args = parser.parse_args(argv)
+    if args.socket is not None and args.port is not None:
+        parser.error("--socket and --port cannot be used together")
+
+    cache = None
+    if args.cache_dir is not None:
+        from result_cache import ResultCache
+        cache = ResultCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024))
+
+    service = SolverService(max(1, args.workers), cache)
+    where = args.socket or (f"127.0.0.1:{args.port}" if args.port is not None else "stdin")
+    print(f"solver service ready on {where} with {service.workers} workers", file=sys.stderr) # stdout is for responses
+    try:
+        if args.socket is not None or args.port is not None:
+            serve_socket(service, args.socket, args.port)
+        else:
+            serve_stdio(service)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+# the modules live in the repo root, next to this tests directory
+from pathlib import Path
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from multipletutgrp import Student
+
+SCHOOLS = ["CCDS", "EEE", "MAE", "SSS", "CoB (NBS)"]
+GENDERS = ["Male", "Female"]
+
+@pytest.fixture
+def make_students():
+    # make_students(rng, count, schools=..., school_weights=None) -> 1 tut grp of random students
+    def make(rng, count, schools=SCHOOLS, school_weights=None, genders=GENDERS, tut_group="G-1"):
+        return [Student(tut_group, str(num), rng.choices(schools, school_weights)[0], f"Student {num}",
+                        rng.choice(genders), round(rng.uniform(3.0, 5.0), 2)) for num in range(count)]
+    return make
+
+@pytest.fixture
+def rng():
+    return random.Random(20241018)
@@ -0,0 +1,39 @@
+# the (school, gender) buckets with cgpa ranges in form_teams must pick from exactly the students
+# can_add_student would accept
+
+from multipletutgrp import (TEAM_SIZE, add_to_team_state, build_candidate_index, calc_avg_cgpa, can_add_student,
+                            eligible_ranges, form_teams, remove_from_index)
+
+def eligible_positions(index, state, tut_avg_cgpa):
+    return sorted(position for bucket, lo, hi in eligible_ranges(index, state, tut_avg_cgpa)
+                  for _, position, _ in bucket[lo:hi])
+
+def test_eligible_ranges_match_can_add_student(rng, make_students):
+    for _ in range(300):
+        students = make_students(rng, rng.randint(8, 40), school_weights=[5, 3, 1, 1, 1])
+        tut_avg_cgpa = calc_avg_cgpa(students)
+        team = rng.sample(students, rng.randint(0, TEAM_SIZE))
+        candidates = [student for student in students if student not in team]
+        state = {'size': 0, 'cgpa_sum': 0.0, 'school_freq': {}, 'gender_freq': {}}
+        for member in team:
+            add_to_team_state(state, member)
+        expected = [position for position, student in enumerate(candidates) if can_add_student(student, team, tut_avg_cgpa)]
+        assert eligible_positions(build_candidate_index(candidates), state, tut_avg_cgpa) == expected
+
+def test_removed_candidates_are_not_eligible(rng, make_students):
+    students = make_students(rng, 30)
+    tut_avg_cgpa = calc_avg_cgpa(students)
+    index = build_candidate_index(students)
+    empty = {'size': 0, 'cgpa_sum': 0.0, 'school_freq': {}, 'gender_freq': {}}
+    removed = rng.sample(range(len(students)), 10)
+    for position in removed:
+        remove_from_index(index, students[position], position)
+    assert eligible_positions(index, empty, tut_avg_cgpa) == sorted(set(range(len(students))) - set(removed))
+
+def test_form_teams_keeps_every_student(rng, make_students):
+    for count in (1, 4, 5, 7, 23, 50):
+        students = make_students(rng, count)
+        teams = form_teams(students, rng)
+        assert len(teams) == max(1, count // TEAM_SIZE)
+        assert sorted(student.student_id for team in teams for student in team) == \
+            sorted(student.student_id for student in students)
@@ -0,0 +1,60 @@
+# criteria come from json files and service requests, so a bad one has to be a ValueError before any code is generated
+
+import pytest
+
+from criteria import check_criteria, compile_criteria
+from multipletutgrp import CGPA_TOLERANCE, RULES, solve_tut_grp
+from service import SolverService, parse_request
+
+@pytest.mark.parametrize("criteria", [
+    [{"type": "mean", "attribute": "GPA"}], # not a field or a column
+    [{"type": "mean", "attribute": "school"}], # not a number
+    [{"type": "mean", "attribute": "cgpa", "weight": "2"}],
+    [{"type": "mean", "attribute": "cgpa", "tolerance": float("nan")}],
+    [{"type": "majority", "attribute": "school", "cap": 1.5}],
+    [{"type": "majority", "attribute": "school", "caps": 0.5}],
+    [{"type": "median", "attribute": "cgpa"}],
+    [],
+])
+def test_bad_criteria_are_rejected(rng, make_students, criteria):
+    students = make_students(rng, 20)
+    with pytest.raises(ValueError):
+        solve_tut_grp(students, seed=1, criteria=criteria)
+    rows = [[s.tutorial_group, s.student_id, s.school, s.name, s.gender, s.cgpa] for s in students]
+    with pytest.raises(ValueError):
+        parse_request({'students': rows, 'options': {'criteria': criteria}})
+
+def test_numeric_extra_column(rng, make_students):
+    students = make_students(rng, 20)
+    for num, student in enumerate(students):
+        student.extra = {'age': str(18 + num % 5), 'club': "chess" if num % 3 else "none"}
+    criteria = [{"type": "mean", "attribute": "age"}, {"type": "majority", "attribute": "club"}]
+    assert len(check_criteria(criteria, students)) == 2
+    students[3].extra['age'] = "n/a"
+    with pytest.raises(ValueError, match="n/a"):
+        check_criteria(criteria, students)
+    del students[0].extra['club'] # a short csv row
+    with pytest.raises(ValueError, match="too short"):
+        check_criteria(criteria[1:], students)
+
+def test_default_criteria_compile_to_the_built_in_rules():
+    criteria = [{"type": "mean", "attribute": "cgpa", "tolerance": CGPA_TOLERANCE},
+                {"type": "majority", "attribute": "school", "cap": 0.5},
+                {"type": "majority", "attribute": "gender", "weight": 1}]
+    assert compile_criteria(criteria) is RULES
+
+def test_service_reports_the_criteria_imbalance(rng, make_students):
+    students = make_students(rng, 20)
+    rows = [[s.tutorial_group, s.student_id, s.school, s.name, s.gender, s.cgpa] for s in students]
+    criteria = [{"type": "mean", "attribute": "cgpa", "tolerance": 0.5, "weight": 10},
+                {"type": "majority", "attribute": "gender", "cap": 0.6}]
+    service = SolverService(workers=1)
+    try:
+        response = service.submit({'id': 1, 'students': rows, 'seed': "x", 'options': {'criteria': criteria}}).result()
+    finally:
+        service.close()
+    rules = compile_criteria(criteria)
+    teams = solve_tut_grp(students, seed="x", criteria=criteria)
+    assert [[student['student_id'] for student in team] for team in response['teams']] == \
+           [[student.student_id for student in team] for team in teams]
+    assert response['imbalance'] == pytest.approx(rules.total_imbalance(teams, *rules.group_means(students)))
@@ -0,0 +1,19 @@
+# the vectorised report has to score the same teams, with the same numbers, as calculate_team_imbalance
+
+import pytest
+
+from evaluate import evaluate_file, evaluate_teams
+from multipletutgrp import calc_avg_cgpa, solve_tut_grps, total_imbalance, write_student_records
+
+def test_report_matches_total_imbalance(tmp_path, rng, make_students):
+    all_students = {tut_group: make_students(rng, 52, tut_group=tut_group) for tut_group in ("G-1", "G-2")}
+    tut_grps = solve_tut_grps(all_students, seed="e")
+    expected = sum(total_imbalance(teams, calc_avg_cgpa(all_students[tut_group])) for tut_group, teams in tut_grps.items())
+
+    _, in_memory = evaluate_teams(tut_grps)
+    write_student_records(tut_grps, tmp_path / "teams.csv")
+    _, from_file = evaluate_file(tmp_path / "teams.csv")
+    for result in (in_memory, from_file):
+        assert len(result['imbalance']) == 20
+        assert sorted(result['size'].tolist()) == [5] * 16 + [6] * 4
+        assert result['imbalance'].sum() == pytest.approx(expected)
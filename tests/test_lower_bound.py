@@ -0,0 +1,54 @@
+# imbalance_lower_bound must never be above the best possible total imbalance: a bound that is too high makes
+# every optimizer stop before it is done. checked against brute force on tut grps small enough to try every split
+
+from itertools import combinations
+
+import pytest
+
+from multipletutgrp import (calc_avg_cgpa, calculate_team_imbalance, formed_team_sizes, imbalance_lower_bound,
+                            optimize_teams, solve_tut_grp, stop_imbalance, total_imbalance)
+
+def best_total_imbalance(students, team_sizes, tut_avg_cgpa):
+    # every way of splitting students into teams of team_sizes
+    if len(team_sizes) == 1:
+        return calculate_team_imbalance(students, tut_avg_cgpa)
+    best = float("inf")
+    for chosen in combinations(range(len(students)), team_sizes[0]):
+        team = [students[position] for position in chosen]
+        rest = [student for position, student in enumerate(students) if position not in chosen]
+        imbalance = calculate_team_imbalance(team, tut_avg_cgpa)
+        if imbalance < best:
+            best = min(best, imbalance + best_total_imbalance(rest, team_sizes[1:], tut_avg_cgpa))
+    return best
+
+@pytest.mark.parametrize("school_weights", [None, [6, 1, 1, 1, 1], [1, 0, 0, 0, 0]])
+def test_lower_bound_is_below_the_optimum(rng, make_students, school_weights):
+    for count in (10, 11, 12, 13):
+        for _ in range(3):
+            students = make_students(rng, count, school_weights=school_weights)
+            tut_avg_cgpa = calc_avg_cgpa(students)
+            team_sizes = formed_team_sizes(count)
+            bound = imbalance_lower_bound(students, team_sizes, tut_avg_cgpa)
+            assert bound <= best_total_imbalance(students, team_sizes, tut_avg_cgpa) + 1e-9
+
+def test_lower_bound_with_a_single_gender(rng, make_students):
+    students = make_students(rng, 12, genders=["Female"])
+    tut_avg_cgpa = calc_avg_cgpa(students)
+    team_sizes = formed_team_sizes(12)
+    bound = imbalance_lower_bound(students, team_sizes, tut_avg_cgpa)
+    assert bound >= 2 * (6 - 3) # every team of 6 is all 1 gender, 3 over half
+    assert bound <= best_total_imbalance(students, team_sizes, tut_avg_cgpa) + 1e-9
+
+@pytest.mark.parametrize("optimizer", ["swap", "anneal", "neighbourhood"])
+def test_optimizers_end_above_the_bound(rng, make_students, optimizer):
+    for count in (12, 37, 120):
+        students = make_students(rng, count, school_weights=[4, 2, 1, 1, 1])
+        tut_avg_cgpa = calc_avg_cgpa(students)
+        bound = imbalance_lower_bound(students, formed_team_sizes(count), tut_avg_cgpa)
+        teams = solve_tut_grp(students, seed=count, optimizer=optimizer, max_evaluations=2000)
+        assert total_imbalance(teams, tut_avg_cgpa) >= bound - 1e-9
+
+def test_no_teams_is_nothing_to_do():
+    assert imbalance_lower_bound([], [], 4.0) == 0.0
+    assert stop_imbalance([], 4.0) == (0.0, 0.0)
+    assert optimize_teams([], 4.0, 10) == []
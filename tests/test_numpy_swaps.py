@@ -0,0 +1,39 @@
+# from NUMPY_MIN_TEAMS teams optimize_teams hands over to numpy_swaps, which takes the best swap per team instead of
+# the first improving one: it has to score teams like calculate_team_imbalance and end up about as good
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import multipletutgrp
+from multipletutgrp import (BOUND_TOLERANCE, NUMPY_MIN_TEAMS, calc_avg_cgpa, calculate_team_imbalance, form_teams,
+                            optimize_teams, total_imbalance)
+from numpy_swaps import optimize_teams_numpy, team_imbalance
+
+def test_team_imbalance_matches_calculate_team_imbalance(rng, make_students):
+    students = make_students(rng, 130, school_weights=[4, 2, 1, 1, 1])
+    tut_avg_cgpa = calc_avg_cgpa(students)
+    for team in form_teams(students, rng):
+        schools = [sum(student.school == school for student in team) for school in {student.school for student in team}]
+        genders = [sum(student.gender == gender for student in team) for gender in {student.gender for student in team}]
+        imbalance = team_imbalance(np.float64(sum(student.cgpa for student in team)), np.int64(len(team)),
+                                   np.int64(max(schools)), np.int64(max(genders)), tut_avg_cgpa)
+        assert float(imbalance) == pytest.approx(calculate_team_imbalance(team, tut_avg_cgpa), abs=1e-9)
+
+def test_numpy_backend_never_makes_it_worse(rng, make_students, monkeypatch):
+    for _ in range(10):
+        students = make_students(rng, rng.randint(NUMPY_MIN_TEAMS * 5, 160), school_weights=rng.choice([None, [4, 2, 1, 1, 1]]))
+        tut_avg_cgpa = calc_avg_cgpa(students)
+        teams = form_teams(students, rng)
+        assert len(teams) >= NUMPY_MIN_TEAMS # so optimize_teams itself would use numpy
+        before = total_imbalance(teams, tut_avg_cgpa)
+        optimized = optimize_teams_numpy([team[:] for team in teams], tut_avg_cgpa, 100)
+        assert sorted(student.student_id for team in optimized for student in team) == \
+            sorted(student.student_id for student in students)
+        after = total_imbalance(optimized, tut_avg_cgpa)
+        assert after <= before + 1e-9
+
+        with monkeypatch.context() as patch: # the pure python optimizer on the same teams
+            patch.setattr(multipletutgrp, "NUMPY_MIN_TEAMS", len(teams) + 1)
+            python_after = total_imbalance(optimize_teams([team[:] for team in teams], tut_avg_cgpa, 100), tut_avg_cgpa)
+        assert after <= python_after + BOUND_TOLERANCE * len(teams)
@@ -0,0 +1,19 @@
+# the profile of a multi start run has to describe the teams that were kept, not the last attempt
+
+import pytest
+
+from multipletutgrp import add_hook, calc_avg_cgpa, remove_hook, solve_tut_grps, total_imbalance
+from profiling import Profiler
+
+def test_multi_start_profile_scores_the_kept_teams(rng, make_students):
+    all_students = {tut_group: make_students(rng, 40, tut_group=tut_group) for tut_group in ("G-1", "G-2", "G-3")}
+    profiler = Profiler()
+    add_hook(profiler)
+    try:
+        tut_grps = solve_tut_grps(all_students, seed="p", attempts=4, target_imbalance=0)
+    finally:
+        remove_hook(profiler)
+    for tut_group, teams in tut_grps.items():
+        row = profiler.summary_row(tut_group, profiler.tut_grps[tut_group])
+        assert row['attempts'] == 4
+        assert row['imbalance'] == pytest.approx(total_imbalance(teams, calc_avg_cgpa(all_students[tut_group])), abs=1e-6)
@@ -0,0 +1,44 @@
+# the output file has to round trip: rebalance.py works on the teams it reads back from "Team n"
+
+from multipletutgrp import form_teams, write_student_records
+from rebalance import read_previous_assignment, rebalance
+
+def team_ids(teams):
+    return sorted(sorted(student.student_id for student in team) for team in teams)
+
+def test_output_reads_back_as_the_same_teams(tmp_path, rng, make_students):
+    tut_grps = {tut_group: form_teams(make_students(rng, 52, tut_group=tut_group), rng) for tut_group in ("G-1", "G-2")}
+    assert [len(team) for team in tut_grps["G-1"]][:3] == [6, 6, 5]
+    write_student_records(tut_grps, tmp_path / "teams.csv")
+    previous = read_previous_assignment(tmp_path / "teams.csv")
+    for tut_group, teams in tut_grps.items():
+        assert team_ids(previous[tut_group].values()) == team_ids(teams)
+
+def test_move_only_needs_the_new_tut_grp(tmp_path, rng, make_students):
+    students = make_students(rng, 20, tut_group="G-1") + make_students(rng, 20, tut_group="G-2")
+    for num, student in enumerate(students):
+        student.student_id = str(num) # unique over both tut grps
+    tut_grps = {"G-1": form_teams(students[:20], rng), "G-2": form_teams(students[20:], rng)}
+    write_student_records(tut_grps, tmp_path / "teams.csv")
+    (tmp_path / "delta.csv").write_text("Action,Tutorial Group,Student ID,School,Name,Gender,CGPA\nmove,G-2,3,,,,\n")
+
+    stats = rebalance(tmp_path / "teams.csv", tmp_path / "delta.csv", tmp_path / "rebalanced.csv")
+    after = read_previous_assignment(tmp_path / "rebalanced.csv")
+    moved = [student for team in after["G-2"].values() for student in team if student.student_id == "3"]
+    assert stats['moved'] == 1 and stats['students'] == 40
+    assert len(moved) == 1 and (moved[0].name, moved[0].cgpa) == (students[3].name, students[3].cgpa)
+
+def test_removing_a_whole_team(tmp_path, rng, make_students):
+    students = make_students(rng, 50, tut_group="G-1")
+    for num, student in enumerate(students):
+        student.student_id = str(num)
+    write_student_records({"G-1": form_teams(students, rng)}, tmp_path / "teams.csv")
+    team = next(iter(read_previous_assignment(tmp_path / "teams.csv")["G-1"].values()))
+    assert len(team) == 5
+    (tmp_path / "delta.csv").write_text("Action,Tutorial Group,Student ID,School,Name,Gender,CGPA\n"
+                                        + "".join(f"remove,G-1,{student.student_id},,,,\n" for student in team))
+
+    stats = rebalance(tmp_path / "teams.csv", tmp_path / "delta.csv", tmp_path / "rebalanced.csv")
+    after = read_previous_assignment(tmp_path / "rebalanced.csv")["G-1"]
+    assert stats['students'] == 45 and len(after) == 9
+    assert sorted(len(team) for team in after.values()) == [5] * 9
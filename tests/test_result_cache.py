@@ -0,0 +1,35 @@
+# a cached multi start result has to come back with its winning seed, or the run cannot be reproduced from its record
+
+from multipletutgrp import add_hook, remove_hook, solve_tut_grps
+from result_cache import ResultCache
+
+def test_cache_hit_reports_the_winning_seed(tmp_path, rng, make_students):
+    all_students = {tut_group: make_students(rng, 20, tut_group=tut_group) for tut_group in ("G-1", "G-2")}
+    runs = []
+    for _ in range(2):
+        events = {}
+        hook = lambda event, data: events.__setitem__(data['tut_group'], data) if event == 'multi_start' else None
+        add_hook(hook)
+        try:
+            cache = ResultCache(tmp_path / "cache")
+            solve_tut_grps(all_students, seed="s", cache=cache, attempts=3)
+        finally:
+            remove_hook(hook)
+        runs.append((cache.hits, events))
+    assert runs[0][0] == 0 and runs[1][0] == 2
+    assert runs[0][1] == runs[1][1] and set(runs[1][1]) == {"G-1", "G-2"}
+
+def test_cache_with_workers_and_a_numeric_extra_column(tmp_path, rng, make_students):
+    # the workers send the teams back, the cache has to match them to the rows the main process read
+    all_students = {tut_group: make_students(rng, 20, tut_group=tut_group) for tut_group in ("G-1", "G-2")}
+    for num, student in enumerate(student for students in all_students.values() for student in students):
+        student.extra = {'Age': str(18 + num % 5)}
+    criteria = [{"type": "mean", "attribute": "Age", "tolerance": 2}, {"type": "majority", "attribute": "school"}]
+    runs = []
+    for _ in range(2):
+        cache = ResultCache(tmp_path / "cache")
+        tut_grps = solve_tut_grps(all_students, workers=2, seed="s", cache=cache, criteria=criteria)
+        runs.append([[student.student_id for student in team] for teams in tut_grps.values() for team in teams])
+        assert all(student.extra['Age'] == str(int(student.extra['Age'])) for students in all_students.values()
+                   for student in students) # still the text of the csv
+    assert cache.hits == 2 and runs[0] == runs[1]
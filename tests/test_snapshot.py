@@ -0,0 +1,27 @@
+# a snapshot has to load as the same students as its csv, extra columns included, so criteria work on either
+
+import csv
+
+from multipletutgrp import read_student_records, solve_tut_grp
+from snapshot import write_snapshot
+
+def test_snapshot_keeps_extra_columns(tmp_path, rng, make_students):
+    students = make_students(rng, 30, tut_group="G-1") + make_students(rng, 30, tut_group="G-2")
+    with (tmp_path / "cohort.csv").open("w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Tutorial Group", "Student ID", "School", "Name", "Gender", "CGPA", "Age", "Club"])
+        for num, student in enumerate(students):
+            row = [student.tutorial_group, str(num), student.school, student.name, student.gender, student.cgpa,
+                   18 + num % 5, "chess" if num % 3 else "none"]
+            writer.writerow(row if num != 7 else row[:7]) # a short row has no Club
+    write_snapshot(tmp_path / "cohort.csv", tmp_path / "cohort.snap")
+
+    from_csv = read_student_records(tmp_path / "cohort.csv")
+    from_snapshot = read_student_records(tmp_path / "cohort.snap")
+    fields = lambda student: (student.student_id, student.school, student.name, student.gender, student.cgpa, student.extra)
+    assert {tut_group: [fields(student) for student in grp] for tut_group, grp in from_snapshot.items()} == \
+           {tut_group: [fields(student) for student in grp] for tut_group, grp in from_csv.items()}
+
+    criteria = [{"type": "mean", "attribute": "Age", "tolerance": 1}, {"type": "majority", "attribute": "school"}]
+    teams = solve_tut_grp(from_snapshot["G-2"], seed=1, criteria=criteria)
+    assert sorted(student.student_id for team in teams for student in team) == sorted(s.student_id for s in from_csv["G-2"])
@@ -0,0 +1,53 @@
+# imbalance_after_swap / apply_swap must agree with calculate_team_imbalance on the swapped teams,
+# otherwise optimize_teams optimises something else than what it reports
+
+import pytest
+
+from multipletutgrp import (apply_swap, calc_avg_cgpa, calculate_team_imbalance, form_teams, imbalance_after_swap,
+                            init_team_state, optimize_teams, total_imbalance)
+
+def test_imbalance_after_swap_matches_recalculation(rng, make_students):
+    for _ in range(50):
+        students = make_students(rng, rng.randint(10, 40))
+        tut_avg_cgpa = calc_avg_cgpa(students)
+        teams = form_teams(students, rng)
+        for _ in range(20):
+            i, j = rng.sample(range(len(teams)), 2)
+            a, b = rng.randrange(len(teams[i])), rng.randrange(len(teams[j]))
+            state = init_team_state(teams[i], tut_avg_cgpa)
+            swapped = teams[i][:a] + [teams[j][b]] + teams[i][a + 1:]
+            assert imbalance_after_swap(state, teams[i][a], teams[j][b], tut_avg_cgpa) == \
+                pytest.approx(calculate_team_imbalance(swapped, tut_avg_cgpa), abs=1e-9)
+
+def test_apply_swap_keeps_state_in_sync(rng, make_students):
+    students = make_students(rng, 30)
+    tut_avg_cgpa = calc_avg_cgpa(students)
+    teams = form_teams(students, rng)
+    states = [init_team_state(team, tut_avg_cgpa) for team in teams]
+    for _ in range(200):
+        i, j = rng.sample(range(len(teams)), 2)
+        a, b = rng.randrange(len(teams[i])), rng.randrange(len(teams[j]))
+        student1, student2 = teams[i][a], teams[j][b]
+        new_imbalance1 = imbalance_after_swap(states[i], student1, student2, tut_avg_cgpa)
+        new_imbalance2 = imbalance_after_swap(states[j], student2, student1, tut_avg_cgpa)
+        teams[i][a], teams[j][b] = student2, student1
+        apply_swap(states[i], student1, student2, new_imbalance1)
+        apply_swap(states[j], student2, student1, new_imbalance2)
+    for team, state in zip(teams, states):
+        fresh = init_team_state(team, tut_avg_cgpa)
+        assert state['size'] == fresh['size']
+        assert state['cgpa_sum'] == pytest.approx(fresh['cgpa_sum'])
+        assert state['school_freq'] == fresh['school_freq']
+        assert state['gender_freq'] == fresh['gender_freq']
+        assert state['imbalance'] == pytest.approx(fresh['imbalance'], abs=1e-9)
+
+def test_optimize_teams_never_makes_it_worse(rng, make_students):
+    for _ in range(20):
+        students = make_students(rng, rng.randint(10, 60))
+        tut_avg_cgpa = calc_avg_cgpa(students)
+        teams = form_teams(students, rng)
+        before = total_imbalance(teams, tut_avg_cgpa)
+        optimized = optimize_teams([team[:] for team in teams], tut_avg_cgpa, 100)
+        assert sorted(student.student_id for team in optimized for student in team) == \
+            sorted(student.student_id for student in students)
+        assert total_imbalance(optimized, tut_avg_cgpa) <= before + 1e-9